@@ -0,0 +1,205 @@
+"""
+Agregasi analytics di MongoDB: jumlah event per bucket waktu.
+
+Setiap seri dihitung dengan pipeline $match + $group ($dateTrunc) sehingga
+yang dikirim ke dashboard hanya angka per bucket, bukan ribuan log mentah.
+Bucket yang sudah lewat tidak akan berubah lagi, jadi hasilnya di-cache per
+bucket dan request berikutnya hanya mengagregasi bucket yang belum di-cache.
+Log bisa tiba terlambat (antrean ingest, batch writer), sehingga bucket baru
+dianggap selesai setelah berakhir lebih dari LOG_FLUSH_INTERVAL +
+ANALYTICS_SETTLE_SECONDS yang lalu.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import db_async
+from db import LOG_FLUSH_INTERVAL
+
+MAX_BUCKETS = 5000
+CACHE_MAX_KEYS = int(os.environ.get("ANALYTICS_CACHE_KEYS", "256"))
+# Jeda tambahan untuk log yang terlambat selain interval flush batch writer
+ANALYTICS_SETTLE_SECONDS = float(os.environ.get("ANALYTICS_SETTLE_SECONDS", "10"))
+
+Bucket = namedtuple("Bucket", ["unit", "size", "delta"])
+
+_UNITS = {"m": ("minute", timedelta(minutes=1)), "h": ("hour", timedelta(hours=1)), "d": ("day", timedelta(days=1))}
+# $dateTrunc dengan binSize > 1 menghitung bucket relatif terhadap 2000-01-01
+_REFERENCE = datetime(2000, 1, 1)
+
+def parse_bucket(bucket: str) -> Bucket:
+    """
+    "15m", "1h", "6h", "1d" -> Bucket. Raise ValueError jika tidak valid.
+    """
+    match = re.fullmatch(r"(\d+)([mhd])", bucket)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Bucket tidak valid: {bucket}")
+    size = int(match.group(1))
+    unit, base = _UNITS[match.group(2)]
+    return Bucket(unit, size, base * size)
+
+def parse_timezone(name: str):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Timezone tidak dikenal: {name}")
+
+def floor_bucket(dt: datetime, bucket: Bucket, tz) -> datetime:
+    """
+    Awal bucket yang memuat `dt`, dihitung dengan aturan yang sama seperti $dateTrunc
+    (waktu lokal `tz`, kelipatan binSize sejak 2000-01-01). Return waktu UTC.
+    """
+    local = dt.astimezone(tz).replace(tzinfo=None)
+    steps = (local - _REFERENCE) // bucket.delta
+    start = _REFERENCE + steps * bucket.delta
+    return start.replace(tzinfo=tz).astimezone(timezone.utc)
+
+def next_bucket(start: datetime, bucket: Bucket, tz) -> datetime:
+    # Maju satu bucket menurut jam dinding lokal, sama seperti $dateTrunc
+    local = start.astimezone(tz).replace(tzinfo=None) + bucket.delta
+    return local.replace(tzinfo=tz).astimezone(timezone.utc)
+
+def ceil_bucket(dt: datetime, bucket: Bucket, tz) -> datetime:
+    start = floor_bucket(dt, bucket, tz)
+    return start if start == dt else next_bucket(start, bucket, tz)
+
+def settled_until(now: datetime, bucket: Bucket, tz) -> datetime:
+    """
+    Batas bucket yang boleh di-cache: semua bucket sebelum waktu ini sudah berakhir
+    minimal LOG_FLUSH_INTERVAL + ANALYTICS_SETTLE_SECONDS yang lalu.
+    """
+    return floor_bucket(now - timedelta(seconds=LOG_FLUSH_INTERVAL + ANALYTICS_SETTLE_SECONDS), bucket, tz)
+
+
+class BucketCache:
+    """
+    Cache hasil per bucket yang sudah selesai. Untuk setiap key (seri + filter +
+    ukuran bucket + timezone) disimpan rentang kontinu [start, until) yang
+    sudah pasti lengkap beserta jumlah per bucket.
+    """
+
+    def __init__(self, max_keys: int = CACHE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, start):
+        # Return (buckets, until) jika rentang cache mencakup `start`
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["start"] <= start < entry["until"]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["buckets"], entry["until"]
+            self.misses += 1
+            return None, None
+
+    def put(self, key, start, until, buckets):
+        with self._lock:
+            self._entries[key] = {"start": start, "until": until, "buckets": buckets}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+
+bucket_cache = BucketCache()
+
+def _as_utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+async def _aggregate(collection_name, match, key_expr, start, end, bucket: Bucket, tz_name):
+    pipeline = [
+        {"$match": {**match, "timestamp": {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": {
+                "bucket": {"$dateTrunc": {
+                    "date": "$timestamp",
+                    "unit": bucket.unit,
+                    "binSize": bucket.size,
+                    "timezone": tz_name,
+                }},
+                "key": key_expr,
+            },
+            "count": {"$sum": 1},
+        }},
+    ]
+    buckets = {}
+    cursor = await db_async.get_collection(collection_name).aggregate(pipeline)
+    async for row in cursor:
+        counts = buckets.setdefault(_as_utc(row["_id"]["bucket"]), {})
+        counts[str(row["_id"]["key"])] = row["count"]
+    return buckets
+
+async def bucketed_counts(series, collection_name, match, key_expr, from_date, to_date, bucket: Bucket, tz_name):
+    """
+    Jumlah event per bucket dan per `key_expr` untuk rentang [from_date, to_date).
+    Return: list {"bucket": ISO waktu lokal, "counts": {key: jumlah}}.
+    """
+    tz = parse_timezone(tz_name)
+    now = datetime.now(timezone.utc)
+    # Rentang dibulatkan ke bucket penuh; bucket yang sedang berjalan dihitung sampai sekarang
+    end = min(ceil_bucket(_as_utc(to_date), bucket, tz), now)
+    start = floor_bucket(_as_utc(from_date), bucket, tz)
+    if start >= end:
+        return []
+    if (end - start) / bucket.delta > MAX_BUCKETS:
+        raise ValueError(f"Terlalu banyak bucket (maks {MAX_BUCKETS}), perbesar ukuran bucket")
+
+    key = (series, collection_name, repr(sorted(match.items())), bucket, tz_name)
+    cached, cached_until = bucket_cache.get(key, start)
+    if cached is not None:
+        buckets = {b: c for b, c in cached.items() if b >= start}
+        if cached_until < end:
+            buckets.update(await _aggregate(collection_name, match, key_expr, cached_until, end, bucket, tz_name))
+    else:
+        buckets = await _aggregate(collection_name, match, key_expr, start, end, bucket, tz_name)
+
+    # Simpan hanya bucket yang sudah selesai dan tidak mungkin lagi menerima log terlambat
+    closed_until = min(settled_until(now, bucket, tz), end)
+    if cached is not None:
+        closed_until = max(closed_until, cached_until)
+    if closed_until > start:
+        bucket_cache.put(key, start, closed_until, {b: c for b, c in buckets.items() if b < closed_until})
+
+    series_data = []
+    current = start
+    while current < end:
+        series_data.append({
+            "bucket": current.astimezone(tz).isoformat(),
+            "counts": buckets.get(current, {}),
+        })
+        current = next_bucket(current, bucket, tz)
+    return series_data
+
+# --- Seri yang dipakai dashboard analytics ---
+async def action_counts(collection_name, from_date, to_date, bucket, tz_name):
+    return await bucketed_counts("actions", collection_name, {}, "$action", from_date, to_date, bucket, tz_name)
+
+async def door_access(from_date, to_date, bucket, tz_name):
+    known = {"user": {"$ne": "Unknown"}}
+    return {
+        "by_user": await bucketed_counts("door_by_user", "log_door", known, "$user", from_date, to_date, bucket, tz_name),
+        "by_source": await bucketed_counts("door_by_source", "log_door", known, "$source", from_date, to_date, bucket, tz_name),
+    }
+
+async def unknown_access_alerts(from_date, to_date, bucket, tz_name):
+    return await bucketed_counts(
+        "alerts", "log_door", {"user": "Unknown"}, {"$literal": "alerts"},
+        from_date, to_date, bucket, tz_name,
+    )
+
+async def clothesline_activity(from_date, to_date, bucket, tz_name):
+    return {
+        "actions": await bucketed_counts("clothesline_actions", "log_clothesline", {}, "$action", from_date, to_date, bucket, tz_name),
+        "rain_sensor_triggers": await bucketed_counts(
+            "clothesline_rain", "log_clothesline", {"source": "Rain Sensor"}, "$action",
+            from_date, to_date, bucket, tz_name,
+        ),
+    }
@@ -0,0 +1,64 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from metrics import registry
+
+
+class PrincipalCache:
+    """
+    Cache LRU ber-TTL untuk user yang sudah terautentikasi, dengan key `sub` dari JWT.
+
+    Menghindari `find_one` ke koleksi users di setiap request REST dan
+    handshake WebSocket. Entri dihapus saat kedaluwarsa, saat cache penuh
+    (yang paling lama tidak dipakai), atau lewat `invalidate` ketika data
+    user berubah.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subject: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, subject: str, user: dict):
+        # hashed_password tidak perlu ikut disimpan di memori
+        principal = {k: v for k, v in user.items() if k != "hashed_password"}
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+
+principal_cache = PrincipalCache(
+    max_size=int(os.environ.get("AUTH_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("AUTH_CACHE_TTL", "60")),
+)
+
+registry.callback(
+    "homytech_auth_cache_lookups_total", "Principal cache lookups by result",
+    lambda: {("hit",): principal_cache.hits, ("miss",): principal_cache.misses}, ["result"], kind="counter",
+)
+registry.callback("homytech_auth_cache_size", "Principals in the cache", lambda: len(principal_cache._entries))
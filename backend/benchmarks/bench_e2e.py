@@ -0,0 +1,314 @@
+"""
+Benchmark end-to-end backend di bawah beban: uvicorn sungguhan (subprocess)
+dengan mosquitto dan mongod lokal.
+
+Yang dijalankan bersamaan selama --duration detik:
+- trafik perangkat sintetis ke homytech/door|clothesline|alert/iot (--rate pesan/detik),
+- --ws-clients subscriber WebSocket di /ws?topics=door,clothesline,alert,
+- --rest-concurrency worker REST (kontrol lampu, query log, latest-state).
+
+Latensi MQTT -> WebSocket diukur dari field `user` unik di setiap pesan pintu.
+Hasil dicetak sebagai JSON (atau ditulis ke --output) agar bisa dibandingkan
+antar-run, mis. sebelum/sesudah mengubah mqtt_client.py atau websocket_manager.py.
+
+    cd backend && python benchmarks/bench_e2e.py --duration 30 --rate 200 --ws-clients 300
+
+Butuh mosquitto dan mongod yang berjalan lokal, serta paket `websockets`
+(ikut uvicorn[standard]). Data benchmark tetap ada di database --mongodb-uri;
+tambahkan --drop-db untuk men-drop database itu setelah selesai.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import subprocess
+import urllib.parse
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+import paho.mqtt.client as mqtt
+from pymongo import MongoClient
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def percentiles(values, scale=1000.0):
+    # Return dalam milidetik
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    def pick(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * scale
+
+    return {
+        "count": len(values),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": values[-1] * scale,
+    }
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def http_json(method, url, body=None, token=None, timeout=30):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+# --- Server ---
+def start_server(args):
+    env = {
+        **os.environ,
+        "MONGODB_URI": args.mongodb_uri,
+        "MQTT_HOST": args.mqtt_host,
+        "MQTT_PORT": str(args.mqtt_port),
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "bench-secret"),
+        "JWT_ALGORITHM": os.environ.get("JWT_ALGORITHM", "HS256"),
+        "EVENT_BUS_BACKEND": "local",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+def wait_ready(base_url, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            status, _ = http_json("GET", f"{base_url}/openapi.json", timeout=2)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become ready")
+
+def login(base_url):
+    email, password = f"bench-{uuid.uuid4().hex[:8]}@homytech.local", "bench-password"
+    http_json("POST", f"{base_url}/api/register", {"email": email, "password": password, "name": "Bench"})
+    status, data = http_json("POST", f"{base_url}/api/login", {"email": email, "password": password})
+    if status != 200:
+        raise RuntimeError(f"Login failed with status {status}")
+    return data["access_token"]
+
+# --- Beban ---
+class Results:
+    def __init__(self):
+        self.sent = {}          # user unik -> waktu publish
+        self.published = 0
+        self.e2e = []
+        self.deliveries = 0
+        self.ws_errors = 0
+        self.rest = {}
+        self.rest_errors = {}
+
+async def ws_subscriber(url, results, stop):
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=30) as ws:
+            while not stop.is_set():
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.perf_counter()
+                message = json.loads(raw)
+                results.deliveries += 1
+                sent = results.sent.get(message.get("data", {}).get("user"))
+                if sent is not None:
+                    results.e2e.append(received - sent)
+    except Exception:
+        results.ws_errors += 1
+
+async def connect_subscribers(url, count, results, stop, batch=50):
+    # Dibuka bertahap agar tidak semuanya handshake sekaligus
+    tasks = []
+    for i in range(0, count, batch):
+        tasks += [asyncio.create_task(ws_subscriber(url, results, stop)) for _ in range(min(batch, count - i))]
+        await asyncio.sleep(0.2)
+    return tasks
+
+async def mqtt_traffic(args, results, stop):
+    client = mqtt.Client(client_id=f"bench_{uuid.uuid4().hex[:8]}")
+    if args.mqtt_username:
+        client.username_pw_set(args.mqtt_username, args.mqtt_password)
+    client.connect(args.mqtt_host, args.mqtt_port)
+    client.loop_start()
+    interval = 1.0 / args.rate
+    next_at = time.perf_counter()
+    seq = 0
+    try:
+        while not stop.is_set():
+            seq += 1
+            if seq % 10 == 0:
+                client.publish("homytech/clothesline/iot", json.dumps({"action": "retract" if seq % 20 else "extend"}))
+            elif seq % 25 == 0:
+                client.publish("homytech/alert/iot", json.dumps({"action": "open"}))
+            else:
+                user = f"bench-{seq}"
+                results.sent[user] = time.perf_counter()
+                client.publish("homytech/door/iot", json.dumps({"user": user, "action": "open"}))
+            results.published += 1
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif seq % 100 == 0:
+                await asyncio.sleep(0)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+REST_CALLS = [
+    ("control_light", "POST", "/api/light/{light_id}", {"user": "bench", "action": "{action}"}),
+    ("door_logs", "GET", "/api/logs/door?limit=20", None),
+    ("light_logs_cursor", "GET", "/api/logs/light?limit=50&count=none", None),
+    ("latest_state", "GET", "/api/latest-state/light", None),
+]
+
+async def rest_worker(base_url, token, results, stop, worker_id):
+    i = worker_id
+    # Setiap worker menelusuri log lampu halaman demi halaman lewat next_cursor,
+    # kembali ke halaman pertama setelah halaman terakhir
+    cursor = None
+    while not stop.is_set():
+        name, method, path, body = REST_CALLS[i % len(REST_CALLS)]
+        i += 1
+        if body:
+            path = path.format(light_id=i % 3 + 1)
+            body = {**body, "action": "on" if i % 2 else "off"}
+        if name == "light_logs_cursor" and cursor:
+            path += f"&cursor={urllib.parse.quote(cursor)}"
+        started = time.perf_counter()
+        try:
+            status, data = await asyncio.to_thread(http_json, method, base_url + path, body, token)
+        except OSError:
+            status = None
+        if status == 200:
+            results.rest.setdefault(name, []).append(time.perf_counter() - started)
+            if name == "light_logs_cursor":
+                cursor = data.get("next_cursor")
+        else:
+            results.rest_errors[name] = results.rest_errors.get(name, 0) + 1
+
+async def run(args, base_url, token, server_pid):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.rest_concurrency))
+    results = Results()
+    stop = asyncio.Event()
+
+    rss_idle = rss_kb(server_pid)
+    ws_url = base_url.replace("http", "ws", 1) + f"/ws?topics=door,clothesline,alert&token={token}"
+    subscribers = await connect_subscribers(ws_url, args.ws_clients, results, stop)
+    await asyncio.sleep(1)
+    rss_connected = rss_kb(server_pid)
+
+    _, stats_before = await asyncio.to_thread(http_json, "GET", f"{base_url}/api/ingest/stats", None, token)
+    started = time.perf_counter()
+    load = [asyncio.create_task(mqtt_traffic(args, results, stop))]
+    load += [
+        asyncio.create_task(rest_worker(base_url, token, results, stop, i))
+        for i in range(args.rest_concurrency)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*load)
+    elapsed = time.perf_counter() - started
+    # Beri waktu pesan yang masih di antrean sampai ke subscriber
+    await asyncio.sleep(args.drain)
+    _, stats_after = await asyncio.to_thread(http_json, "GET", f"{base_url}/api/ingest/stats", None, token)
+    rss_end = rss_kb(server_pid)
+    await asyncio.gather(*subscribers)
+
+    processed = stats_after["processed"] - stats_before["processed"]
+    connected = args.ws_clients - results.ws_errors
+    return {
+        "config": {
+            "duration": args.duration,
+            "rate": args.rate,
+            "ws_clients": args.ws_clients,
+            "rest_concurrency": args.rest_concurrency,
+        },
+        "ingest": {
+            "published": results.published,
+            "processed": processed,
+            "dropped": stats_after["dropped"] - stats_before["dropped"],
+            "failed": stats_after["failed"] - stats_before["failed"],
+            "msgs_per_sec": processed / elapsed,
+            "pipeline_latency_p50_ms": stats_after["latency_p50"] * 1000,
+            "pipeline_latency_p99_ms": stats_after["latency_p99"] * 1000,
+        },
+        "e2e_latency_ms": percentiles(results.e2e),
+        "websocket": {
+            "connected": connected,
+            "errors": results.ws_errors,
+            "deliveries": results.deliveries,
+            "door_deliveries_expected": len(results.sent) * connected,
+        },
+        "rest": {
+            name: {**percentiles(timings), "errors": results.rest_errors.get(name, 0),
+                   "rps": len(timings) / elapsed}
+            for name, timings in results.rest.items()
+        },
+        "memory_kb": {
+            "rss_idle": rss_idle,
+            "rss_connected": rss_connected,
+            "rss_end": rss_end,
+            "per_connection": (rss_connected - rss_idle) / connected if connected else None,
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=100, help="pesan MQTT per detik")
+    parser.add_argument("--ws-clients", type=int, default=200)
+    parser.add_argument("--rest-concurrency", type=int, default=16)
+    parser.add_argument("--drain", type=float, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/homytech_bench")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--mqtt-username", default=os.environ.get("MQTT_USERNAME"))
+    parser.add_argument("--mqtt-password", default=os.environ.get("MQTT_PASSWORD"))
+    parser.add_argument("--drop-db", action="store_true", help="drop database --mongodb-uri setelah selesai")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = start_server(args)
+    try:
+        wait_ready(base_url, server)
+        token = login(base_url)
+        report = asyncio.run(run(args, base_url, token, server.pid))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        if args.drop_db:
+            mongo = MongoClient(args.mongodb_uri)
+            mongo.drop_database(mongo.get_default_database().name)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark serialisasi halaman log: jalur lama (db._serialize_log +
+convert_mongo_types + JSONResponse) dibandingkan serializers.serialize_log +
+FastJSONResponse.
+
+    cd backend && python benchmarks/bench_serializer.py [--rows 1000] [--repeat 50]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from serializers import JAKARTA_TZ, serialize_log, encode_json  # noqa: E402
+
+# --- Jalur lama, disalin dari main.py / db.py sebelum serializers.py ---
+def to_jakarta_time(dt):
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(JAKARTA_TZ)
+
+def convert_mongo_types(obj, to_jakarta=False):
+    if isinstance(obj, dict):
+        return {k: convert_mongo_types(v, to_jakarta) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_mongo_types(i, to_jakarta) for i in obj]
+    elif isinstance(obj, ObjectId):
+        return str(obj)
+    elif isinstance(obj, datetime):
+        if to_jakarta:
+            return to_jakarta_time(obj).isoformat()
+        return obj.isoformat()
+    elif isinstance(obj, str):
+        try:
+            dt = datetime.fromisoformat(obj)
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            if to_jakarta:
+                return to_jakarta_time(dt).isoformat()
+            return dt.isoformat()
+        except Exception:
+            return obj
+    else:
+        return obj
+
+def legacy_serialize_log(log):
+    log["id"] = str(log.get("_id", ""))
+    log["_id"] = str(log.get("_id", ""))
+    if "timestamp" in log and hasattr(log["timestamp"], "isoformat"):
+        log["timestamp"] = log["timestamp"].isoformat()
+    return log
+
+def legacy_page(docs):
+    logs = [legacy_serialize_log(dict(doc)) for doc in docs]
+    logs = [convert_mongo_types(log, to_jakarta=True) for log in logs]
+    # JSONResponse Starlette memakai json.dumps
+    return json.dumps({"logs": logs, "total": len(logs)}, ensure_ascii=False,
+                      allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+def fast_page(docs):
+    logs = [serialize_log("log_light", doc) for doc in docs]
+    return encode_json({"logs": logs, "total": len(logs)})
+
+def make_docs(rows):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "user": f"user-{i % 7}",
+            "light_id": i % 3 + 1,
+            "action": "on" if i % 2 else "off",
+            "timestamp": start + timedelta(minutes=i),
+        }
+        for i in range(rows)
+    ]
+
+def bench(fn, docs, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(docs)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"median_ms": timings[len(timings) // 2] * 1000, "min_ms": timings[0] * 1000}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    docs = make_docs(args.rows)
+    legacy = bench(legacy_page, docs, args.repeat)
+    fast = bench(fast_page, docs, args.repeat)
+    print(json.dumps({
+        "rows": args.rows,
+        "legacy": legacy,
+        "fast": fast,
+        "speedup": legacy["median_ms"] / fast["median_ms"],
+    }, indent=2))
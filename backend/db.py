@@ -1,256 +1,259 @@
 import os
+import json
+import base64
 import logging
+import threading
+from functools import partial
 from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
 from pymongo import MongoClient
-from passlib.context import CryptContext
+from log_writer import BatchLogWriter
+from metrics import registry
 
 # Setup logger
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # --- Koneksi MongoDB ---
+# Client dibuat saat pertama dipakai, per proses. Dengan gunicorn, import
+# bisa terjadi di master sebelum fork; client (dan socket-nya) tidak boleh
+# ikut terbawa ke worker, jadi referensinya dibuang di child setelah fork.
 mongo_uri = os.environ.get("MONGODB_URI")
-client = MongoClient(mongo_uri)
-db = client.get_default_database()  # Mengambil 'homytech' dari URI
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pool dan timeout, dipakai juga oleh AsyncMongoClient di db_async.py.
+# Timeout pendek membuat request gagal cepat saat MongoDB mati alih-alih menggantung.
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> MongoClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(mongo_uri, **MONGO_CLIENT_OPTIONS)
+    return _client
+
+def get_database():
+    return get_client().get_default_database()  # Mengambil 'homytech' dari URI
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def ping():
+    # Raise exception pymongo jika MongoDB tidak bisa dijangkau dalam serverSelectionTimeoutMS
+    return get_database().command("ping")
+
+def _reset_client_after_fork():
+    # Jangan close(): socket milik proses induk. Cukup buat client baru saat dipakai.
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_client_after_fork)
 
 def current_utc_time():
     # Always store as UTC in DB
     return datetime.now(timezone.utc)
 
+# --- Mode penyimpanan log ---
+# "standard"   : log_door / log_light / log_clothesline koleksi biasa
+# "timeseries" : log disimpan di koleksi time-series log_door_ts dst.
+# Kode lain tetap memakai nama logis (log_door, ...); get_collection yang
+# menerjemahkan ke nama koleksi fisik sesuai mode.
+LOG_STORAGE_MODE = os.environ.get("LOG_STORAGE_MODE", "standard").lower()
+TIMESERIES_SUFFIX = "_ts"
+# metaField koleksi time-series: identitas perangkat/sumber event
+LOG_META_FIELDS = {
+    "log_door": "source",
+    "log_light": "light_id",
+    "log_clothesline": "source",
+}
+
+if LOG_STORAGE_MODE not in ("standard", "timeseries"):
+    raise ValueError(f"Invalid LOG_STORAGE_MODE: {LOG_STORAGE_MODE}")
+
+def physical_collection_name(collection_name: str, mode: str = None) -> str:
+    mode = mode or LOG_STORAGE_MODE
+    if mode == "timeseries" and collection_name in LOG_META_FIELDS:
+        return collection_name + TIMESERIES_SUFFIX
+    return collection_name
+
 # --- Fungsi untuk Mendapatkan Koleksi --- 
 def get_collection(collection_name: str):
     try:
         # Koneksi ke koleksi MongoDB, pastikan koleksi ada
-        return db[collection_name]
+        return get_database()[physical_collection_name(collection_name)]
     except Exception as e:
         logger.error(f"Failed to get collection {collection_name}: {e}")
         raise
 
-# --- Fungsi untuk Menyisipkan Log RFID --- 
-def insert_door_log(user: str, action: str, source: str, timestamp=None):
-    timestamp = timestamp or current_utc_time()
-    try:
-        collection = get_collection("log_door")
-        collection.insert_one({
-            "user": user,
-            "action": action,
-            "source": source,
-            "timestamp": timestamp,
-        })
-        logger.info(f"Inserted door log: User={user}, action={action}, Source={source}")
-    except Exception as e:
-        logger.error(f"Error inserting door log: {e}")
+# --- Batch writer untuk log perangkat ---
+LOG_COLLECTIONS = tuple(LOG_META_FIELDS)
+_log_writer = None
 
-# --- Fungsi untuk Menyisipkan Log light --- 
-def insert_light_log(light_id: int, action: str, user: str, timestamp=None):
-    timestamp = timestamp or current_utc_time()  # Gunakan waktu UTC
-    try:
-        collection = get_collection("log_light")
-        collection.insert_one({
-            "user": user, 
-            "light_id": light_id,
-            "action": action,
-            "timestamp": timestamp
-        })
-        logger.info(f"Inserted light log: LightID={light_id}, action={action}")
-    except Exception as e:
-        logger.error(f"Error inserting light log: {e}")
+# Log bisa tertahan di batch writer paling lama selama ini sebelum tertulis (dipakai juga analytics)
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "1.0"))
 
-# --- Fungsi untuk Menyisipkan Log Jemuran --- 
-def insert_clothesline_log(action: str, source: str, user: str, timestamp=None):
-    timestamp = timestamp or current_utc_time()  # Gunakan waktu UTC
-    try:
-        collection = get_collection("log_clothesline")
-        collection.insert_one({
-            "user": user,
-            "action": action,
-            "source": source,
-            "timestamp": timestamp
-        })
-        logger.info(f"Inserted clothesline log: Action={action}")
-    except Exception as e:
-        logger.error(f"Error inserting clothesline log: {e}")
+def start_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        _log_writer = BatchLogWriter(
+            get_collection,
+            LOG_COLLECTIONS,
+            batch_size=int(os.environ.get("LOG_BATCH_SIZE", "200")),
+            flush_interval=LOG_FLUSH_INTERVAL,
+            max_queue_size=int(os.environ.get("LOG_QUEUE_SIZE", "10000")),
+            block_timeout=float(os.environ.get("LOG_QUEUE_BLOCK_TIMEOUT", "0.5")),
+        )
+        _log_writer.start()
+    return _log_writer
 
-# --- Fungsi untuk Mendapatkan Status Terbaru dari Light, Pintu, dan Jemuran ---
-def get_latest_light_state():
-    try:
-        collection = get_collection("log_light")
-        latest_logs = collection.aggregate([
-            {"$sort": {"timestamp": -1}},
-            {"$group": {
-                "_id": "$light_id",
-                "user": {"$first": "$user"},
-                "action": {"$first": "$action"},
-                "timestamp": {"$first": "$timestamp"},
-            }},
-            {"$project": {
-                "light_id": "$_id",
-                "user": 1,
-                "action": 1,
-                "timestamp": 1,
-                "_id": 0,
-            }}
-        ])
-        return {"lights": list(latest_logs)}
-    except Exception as e:
-        logger.error(f"Error fetching latest lights state: {e}")
-        return {"lights": []}
+def stop_log_writer(timeout: float = 10.0):
+    global _log_writer
+    if _log_writer is not None:
+        _log_writer.stop(timeout)
+        _log_writer = None
 
-def get_latest_door_state():
-    try:
-        collection = get_collection("log_door")
-        latest = collection.find_one(
-            {"user": {"$ne": "Unknown"}},  # Filter: user tidak sama dengan "Unknown"
-            sort=[("timestamp", -1)]
-        )
-        return latest if latest else {}
-    except Exception as e:
-        logger.error(f"Error fetching latest door state: {e}")
-        return {}
+def get_log_writer():
+    return _log_writer
 
-def get_latest_clothesline_state():
-    try:
-        collection = get_collection("log_clothesline")
-        latest = collection.find_one(sort=[("timestamp", -1)])
-        return latest if latest else {}
-    except Exception as e:
-        logger.error(f"Error fetching latest clothesline state: {e}")
+def _log_writer_metric(field):
+    if _log_writer is None:
         return {}
+    if field == "queue_depth":
+        return {(name,): _log_writer.queue_depth(name) for name in LOG_COLLECTIONS}
+    return {(name,): stats[field] for name, stats in _log_writer.stats.items()}
 
-def get_door_logs(page=1, limit=10, user=None, action=None, source=None, from_date=None, to_date=None):
-    collection = get_collection("log_door")
-    query = {}
-    if user:
-        query["user"] = user
-    if action:
-        query["action"] = action
-    if source:
-        query["source"] = source
-    if from_date or to_date:
-        query["timestamp"] = {}
-        if from_date:
-            query["timestamp"]["$gte"] = from_date
-        if to_date:
-            query["timestamp"]["$lte"] = to_date
-
-    total = collection.count_documents(query)
-    skips = limit * (page - 1)
-    logs = list(
-        collection.find(query)
-        .sort("timestamp", -1)
-        .skip(skips)
-        .limit(limit)
+registry.callback(
+    "homytech_log_writer_queue_depth", "Logs waiting in the batch writer queue",
+    lambda: _log_writer_metric("queue_depth"), ["collection"],
+)
+for _field in ("written", "dropped", "failed"):
+    registry.callback(
+        f"homytech_log_writer_{_field}_total", f"Logs {_field} by the batch writer",
+        partial(_log_writer_metric, _field), ["collection"], kind="counter",
     )
-    for log in logs:
-        log["id"] = str(log.get("_id", ""))
-        log["_id"] = str(log.get("_id", ""))
-        if "timestamp" in log and hasattr(log["timestamp"], "isoformat"):
-            log["timestamp"] = log["timestamp"].isoformat()
-    return {"logs": logs, "total": total}
 
-def get_light_logs(page=1, limit=10, user=None, action=None, light_id=None, from_date=None, to_date=None):
-    collection = get_collection("log_light")
-    query = {}
-    if user:
-        query["user"] = user
-    if action:
-        query["action"] = action
-    if light_id:
-        query["light_id"] = light_id
-    if from_date or to_date:
-        query["timestamp"] = {}
-        if from_date:
-            query["timestamp"]["$gte"] = from_date
-        if to_date:
-            query["timestamp"]["$lte"] = to_date
+# --- Fungsi untuk Mendapatkan Status Terbaru dari Light, Pintu, dan Jemuran ---
+# Pipeline status terakhir per lampu, dipakai juga oleh db_async.
+# Sort (light_id, timestamp) cocok dengan index light_id_timestamp_desc
+# sehingga $group + $first bisa dilayani DISTINCT_SCAN tanpa sort seluruh koleksi.
+LATEST_LIGHT_PIPELINE = [
+    {"$sort": {"light_id": 1, "timestamp": -1}},
+    {"$group": {
+        "_id": "$light_id",
+        "user": {"$first": "$user"},
+        "action": {"$first": "$action"},
+        "timestamp": {"$first": "$timestamp"},
+    }},
+    {"$project": {
+        "light_id": "$_id",
+        "user": 1,
+        "action": 1,
+        "timestamp": 1,
+        "_id": 0,
+    }}
+]
 
-    total = collection.count_documents(query)
-    skips = limit * (page - 1)
-    logs = list(
-        collection.find(query)
-        .sort("timestamp", -1)
-        .skip(skips)
-        .limit(limit)
-    )
-    for log in logs:
-        log["id"] = str(log.get("_id", ""))
-        log["_id"] = str(log.get("_id", ""))
-        if "timestamp" in log and hasattr(log["timestamp"], "isoformat"):
-            log["timestamp"] = log["timestamp"].isoformat()
-    return {"logs": logs, "total": total}
+# Filter status pintu terakhir: abaikan percobaan akses "Unknown"
+LATEST_DOOR_FILTER = {"user": {"$ne": "Unknown"}}
 
-def get_clothesline_logs(page=1, limit=10, user=None, action=None, source=None, from_date=None, to_date=None):
-    collection = get_collection("log_clothesline")
+def _build_log_query(user=None, action=None, from_date=None, to_date=None, **fields):
+    """
+    Menyusun filter MongoDB untuk query log.
+    `fields` berisi filter tambahan per koleksi (source / light_id).
+    """
     query = {}
     if user:
         query["user"] = user
     if action:
         query["action"] = action
-    if source:
-        query["source"] = source
+    for field, value in fields.items():
+        if value:
+            query[field] = value
     if from_date or to_date:
         query["timestamp"] = {}
         if from_date:
             query["timestamp"]["$gte"] = from_date
         if to_date:
             query["timestamp"]["$lte"] = to_date
+    return query
 
-    total = collection.count_documents(query)
-    skips = limit * (page - 1)
-    logs = list(
-        collection.find(query)
-        .sort("timestamp", -1)
-        .skip(skips)
-        .limit(limit)
-    )
-    for log in logs:
-        log["id"] = str(log.get("_id", ""))
-        log["_id"] = str(log.get("_id", ""))
-        if "timestamp" in log and hasattr(log["timestamp"], "isoformat"):
-            log["timestamp"] = log["timestamp"].isoformat()
-    return {"logs": logs, "total": total}
+# --- Paginasi log: page/limit (skip) atau keyset (timestamp, _id) ---
+LOG_SORT = [("timestamp", -1), ("_id", -1)]
+# Batas count_documents untuk mode "estimated" bila ada filter
+ESTIMATED_COUNT_CAP = 10000
 
-def get_user_by_email(email: str):
+def encode_cursor(log: dict, direction: str) -> str:
     """
-    Mengambil user dari koleksi 'users' berdasarkan email.
-    Return: dict user (termasuk hashed_password) atau None jika tidak ditemukan.
+    Membuat token cursor opaque dari (timestamp, _id) sebuah log.
+    direction "next" = log lebih lama, "prev" = log lebih baru.
     """
-    try:
-        collection = get_collection("users")
-        user = collection.find_one({"email": email})
-        if user:
-            user["id"] = str(user.get("_id", ""))
-            user["_id"] = str(user.get("_id", ""))
-        return user
-    except Exception as e:
-        logger.error(f"Error fetching user by email: {e}")
-        return None
+    raw = json.dumps([log["timestamp"].isoformat(), str(log["_id"]), direction])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-def register_user(email: str, password: str, name: str = None):
+def decode_cursor(token: str):
     """
-    Mendaftarkan user baru ke koleksi 'users'.
-    Password akan di-hash sebelum disimpan.
-    Return: dict user baru atau None jika email sudah terdaftar.
+    Kebalikan encode_cursor. Raise ValueError jika token tidak valid.
     """
     try:
-        collection = get_collection("users")
-        # Cek apakah email sudah terdaftar
-        if collection.find_one({"email": email}):
-            return None
-        hashed_password = pwd_context.hash(password)
-        user_data = {
-            "email": email,
-            "hashed_password": hashed_password,
-            "created_at": current_utc_time()
-        }
-        if name:
-            user_data["name"] = name
-        result = collection.insert_one(user_data)
-        user_data["id"] = str(result.inserted_id)
-        user_data["_id"] = str(result.inserted_id)
-        return user_data
-    except Exception as e:
-        logger.error(f"Error registering user: {e}")
-        return None
\ No newline at end of file
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        timestamp, log_id, direction = json.loads(raw)
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return datetime.fromisoformat(timestamp), ObjectId(log_id), direction
+    except (ValueError, TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
+def _page_spec(query: dict, page: int, limit: int, cursor: str = None):
+    """
+    Return (query, sort, skip, direction) untuk satu halaman log.
+    Tanpa cursor dipakai mode page/limit lama; dengan cursor, halaman
+    dilanjutkan dari posisi (timestamp, _id) tanpa skip.
+    """
+    if not cursor:
+        return query, LOG_SORT, limit * (page - 1), None
+    timestamp, log_id, direction = decode_cursor(cursor)
+    op = "$lt" if direction == "next" else "$gt"
+    keyset = {"$or": [
+        {"timestamp": {op: timestamp}},
+        {"timestamp": timestamp, "_id": {op: log_id}},
+    ]}
+    order = -1 if direction == "next" else 1
+    return (
+        {"$and": [query, keyset]} if query else keyset,
+        [("timestamp", order), ("_id", order)],
+        0,
+        direction,
+    )
+
+def _build_page(logs: list, limit: int, page: int, direction: str = None):
+    # `logs` diambil dengan limit + 1 untuk mendeteksi masih ada halaman berikutnya
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    if direction == "prev":
+        logs.reverse()
+        has_newer, has_older = has_more, True
+    elif direction == "next":
+        has_newer, has_older = True, has_more
+    else:
+        has_newer, has_older = page > 1, has_more
+    return {
+        "logs": logs,
+        "next_cursor": encode_cursor(logs[-1], "next") if logs and has_older else None,
+        "prev_cursor": encode_cursor(logs[0], "prev") if logs and has_newer else None,
+    }
@@ -0,0 +1,245 @@
+import os
+import asyncio
+import logging
+from pymongo import AsyncMongoClient
+from serializers import LOG_PROJECTIONS, serialize_log
+from metrics import db_operation
+from tracing import span, query_span
+
+from db import (
+    current_utc_time,
+    get_log_writer,
+    MONGO_CLIENT_OPTIONS,
+    physical_collection_name,
+    _build_log_query,
+    _page_spec,
+    _build_page,
+    ESTIMATED_COUNT_CAP,
+    LATEST_LIGHT_PIPELINE,
+    LATEST_DOOR_FILTER,
+)
+
+# Setup logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# --- Koneksi MongoDB (async) ---
+# Satu-satunya implementasi query untuk jalur request (handler FastAPI, MQTT ingest).
+# db.py hanya menyimpan client sync, batch writer, dan helper query/paginasi bersama
+# yang juga dipakai skrip (indexes, timeseries, retention, light_usage backfill).
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get("MONGO_WARMUP_CONNECTIONS", "4"))
+
+_client = None
+
+def get_async_client():
+    # Client dibuat saat pertama dipakai agar terikat ke event loop yang berjalan
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(os.environ.get("MONGODB_URI"), **MONGO_CLIENT_OPTIONS)
+    return _client
+
+async def ping():
+    return await get_async_client().get_default_database().command("ping")
+
+async def warm_up(connections: int = MONGO_WARMUP_CONNECTIONS):
+    """
+    Membuka `connections` koneksi pool sekaligus (ping paralel) agar request
+    pertama setelah startup tidak menanggung biaya handshake/autentikasi.
+    """
+    await asyncio.gather(*(ping() for _ in range(max(1, connections))))
+
+async def close_async_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+def get_collection(collection_name: str):
+    try:
+        return get_async_client().get_default_database()[physical_collection_name(collection_name)]
+    except Exception as e:
+        logger.error(f"Failed to get collection {collection_name}: {e}")
+        raise
+
+async def _write_log(collection_name: str, doc: dict):
+    # Batch writer dipakai tanpa blocking agar event loop tidak pernah menunggu antrean
+    writer = get_log_writer()
+    if writer is not None:
+        writer.submit(collection_name, doc, block=False)
+    else:
+        await get_collection(collection_name).insert_one(doc)
+
+# --- Insert log ---
+@db_operation
+async def insert_door_log(user: str, action: str, source: str, timestamp=None):
+    timestamp = timestamp or current_utc_time()
+    try:
+        await _write_log("log_door", {
+            "user": user,
+            "action": action,
+            "source": source,
+            "timestamp": timestamp,
+        })
+        logger.info(f"Inserted door log: User={user}, action={action}, Source={source}")
+    except Exception as e:
+        logger.error(f"Error inserting door log: {e}")
+
+@db_operation
+async def insert_light_log(light_id: int, action: str, user: str, timestamp=None):
+    timestamp = timestamp or current_utc_time()
+    try:
+        await _write_log("log_light", {
+            "user": user,
+            "light_id": light_id,
+            "action": action,
+            "timestamp": timestamp
+        })
+        logger.info(f"Inserted light log: LightID={light_id}, action={action}")
+    except Exception as e:
+        logger.error(f"Error inserting light log: {e}")
+
+@db_operation
+async def insert_clothesline_log(action: str, source: str, user: str, timestamp=None):
+    timestamp = timestamp or current_utc_time()
+    try:
+        await _write_log("log_clothesline", {
+            "user": user,
+            "action": action,
+            "source": source,
+            "timestamp": timestamp
+        })
+        logger.info(f"Inserted clothesline log: Action={action}")
+    except Exception as e:
+        logger.error(f"Error inserting clothesline log: {e}")
+
+# --- Status terbaru ---
+# Tidak menangkap exception: dipakai untuk memuat device shadow, yang harus
+# tahu bahwa MongoDB gagal (lalu mencoba lagi) alih-alih menganggap status kosong.
+@db_operation
+async def get_latest_light_state():
+    collection = get_collection("log_light")
+    with query_span("aggregate", collection.name, LATEST_LIGHT_PIPELINE):
+        cursor = await collection.aggregate(LATEST_LIGHT_PIPELINE)
+        return {"lights": await cursor.to_list()}
+
+@db_operation
+async def get_latest_door_state():
+    collection = get_collection("log_door")
+    with query_span("find_one", collection.name, LATEST_DOOR_FILTER, [("timestamp", -1)]):
+        latest = await collection.find_one(LATEST_DOOR_FILTER, sort=[("timestamp", -1)])
+    return latest if latest else {}
+
+@db_operation
+async def get_latest_clothesline_state():
+    collection = get_collection("log_clothesline")
+    with query_span("find_one", collection.name, {}, [("timestamp", -1)]):
+        latest = await collection.find_one(sort=[("timestamp", -1)])
+    return latest if latest else {}
+
+# --- Log dengan paginasi ---
+@db_operation
+async def _count_logs(collection, query: dict, count: str):
+    if count == "none":
+        return None
+    with query_span(f"count:{count}", collection.name, query):
+        if count == "exact":
+            return await collection.count_documents(query)
+        if not query:
+            return await collection.estimated_document_count()
+        return await collection.count_documents(query, limit=ESTIMATED_COUNT_CAP)
+
+async def _get_logs(collection_name, page, limit, query, cursor=None, count="exact"):
+    collection = get_collection(collection_name)
+    page_query, sort, skips, direction = _page_spec(query, page, limit, cursor)
+    with query_span("find", collection.name, page_query, sort):
+        logs = await (
+            collection.find(page_query, LOG_PROJECTIONS[collection_name])
+            .sort(sort)
+            .skip(skips)
+            .limit(limit + 1)
+            .to_list()
+        )
+    result = _build_page(logs, limit, page, direction)
+    with span("serialize", rows=len(result["logs"])):
+        result["logs"] = [serialize_log(collection_name, log) for log in result["logs"]]
+    result["total"] = await _count_logs(collection, query, count)
+    return result
+
+@db_operation
+async def get_door_logs(page=1, limit=10, user=None, action=None, source=None, from_date=None, to_date=None,
+                        cursor=None, count="exact"):
+    query = _build_log_query(user, action, from_date, to_date, source=source)
+    return await _get_logs("log_door", page, limit, query, cursor, count)
+
+@db_operation
+async def get_light_logs(page=1, limit=10, user=None, action=None, light_id=None, from_date=None, to_date=None,
+                        cursor=None, count="exact"):
+    query = _build_log_query(user, action, from_date, to_date, light_id=light_id)
+    return await _get_logs("log_light", page, limit, query, cursor, count)
+
+@db_operation
+async def get_clothesline_logs(page=1, limit=10, user=None, action=None, source=None, from_date=None, to_date=None,
+                        cursor=None, count="exact"):
+    query = _build_log_query(user, action, from_date, to_date, source=source)
+    return await _get_logs("log_clothesline", page, limit, query, cursor, count)
+
+# --- User ---
+def _serialize_user(user):
+    if user:
+        user["id"] = str(user.get("_id", ""))
+        user["_id"] = str(user.get("_id", ""))
+    return user
+
+@db_operation
+async def get_user_by_email(email: str):
+    """
+    Mengambil user dari koleksi 'users' berdasarkan email.
+    Return: dict user (termasuk hashed_password) atau None jika tidak ditemukan.
+    """
+    try:
+        collection = get_collection("users")
+        with query_span("find_one", collection.name, {"email": email}):
+            return _serialize_user(await collection.find_one({"email": email}))
+    except Exception as e:
+        logger.error(f"Error fetching user by email: {e}")
+        return None
+
+@db_operation
+async def register_user(email: str, hashed_password: str, name: str = None):
+    """
+    Mendaftarkan user baru ke koleksi 'users'.
+    `hashed_password` sudah di-hash oleh password_hashing.hash_password.
+    Return: dict user baru atau None jika email sudah terdaftar.
+    """
+    try:
+        collection = get_collection("users")
+        # Cek apakah email sudah terdaftar
+        if await collection.find_one({"email": email}):
+            return None
+        user_data = {
+            "email": email,
+            "hashed_password": hashed_password,
+            "created_at": current_utc_time()
+        }
+        if name:
+            user_data["name"] = name
+        result = await collection.insert_one(user_data)
+        user_data["id"] = str(result.inserted_id)
+        user_data["_id"] = str(result.inserted_id)
+        return user_data
+    except Exception as e:
+        logger.error(f"Error registering user: {e}")
+        return None
+
+@db_operation
+async def update_password_hash(email: str, hashed_password: str):
+    """
+    Mengganti hash password user (rehash saat login setelah BCRYPT_ROUNDS berubah).
+    Return: True jika dokumen user diperbarui.
+    """
+    collection = get_collection("users")
+    with query_span("update_one", collection.name, {"email": email}):
+        result = await collection.update_one(
+            {"email": email}, {"$set": {"hashed_password": hashed_password, "password_updated_at": current_utc_time()}}
+        )
+    return result.modified_count > 0
@@ -0,0 +1,128 @@
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class DeviceShadow:
+    """
+    Cache in-memory status terakhir setiap lampu, pintu, dan jemuran.
+
+    Dimuat sekali dari MongoDB saat startup lalu diperbarui di setiap jalur
+    tulis (endpoint kontrol REST dan pesan MQTT), sehingga endpoint
+    latest-state dan sync-state tidak perlu query ke database. Setiap
+    perangkat punya nomor `version` yang naik setiap kali statusnya berubah.
+    Diakses dari event loop dan thread MQTT, jadi semua akses memakai lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lights = {}
+        self._door = {}
+        self._clothesline = {}
+        # False sampai load() berhasil; selama itu status yang ada mungkin belum lengkap
+        self.loaded = False
+
+    def load(self, light_state: dict, door_state: dict, clothesline_state: dict):
+        """
+        Memuat status dari MongoDB. Jika load terjadi setelah startup (retry), perangkat
+        yang sudah menerima event sejak startup dipertahankan karena statusnya lebih baru.
+        """
+        with self._lock:
+            loaded_lights = {
+                light["light_id"]: self._entry(light, ("light_id", "user", "action", "timestamp"))
+                for light in light_state.get("lights", [])
+            }
+            self._lights = {**loaded_lights, **self._lights}
+            self._door = self._door or self._entry(door_state, ("user", "action", "source", "timestamp"))
+            self._clothesline = self._clothesline or self._entry(clothesline_state, ("user", "action", "source", "timestamp"))
+            self.loaded = True
+        logger.info(f"Device shadow loaded: {len(self._lights)} lights, door={bool(self._door)}, clothesline={bool(self._clothesline)}")
+
+    @staticmethod
+    def _entry(doc: dict, fields: tuple, version: int = 1):
+        if not doc:
+            return {}
+        entry = {field: doc.get(field) for field in fields}
+        entry["version"] = version
+        return entry
+
+    def update_light(self, light_id: int, action: str, user: str, timestamp):
+        with self._lock:
+            version = self._lights.get(light_id, {}).get("version", 0) + 1
+            self._lights[light_id] = {
+                "light_id": light_id,
+                "user": user,
+                "action": action,
+                "timestamp": timestamp,
+                "version": version,
+            }
+
+    def remove_light(self, light_id: int):
+        with self._lock:
+            self._lights.pop(light_id, None)
+
+    def update_door(self, user: str, action: str, source: str, timestamp):
+        # Sama seperti get_latest_door_state: percobaan akses "Unknown" bukan status pintu
+        if user == "Unknown":
+            return
+        with self._lock:
+            self._door = {
+                "user": user,
+                "action": action,
+                "source": source,
+                "timestamp": timestamp,
+                "version": self._door.get("version", 0) + 1,
+            }
+
+    def update_clothesline(self, action: str, source: str, user: str, timestamp):
+        with self._lock:
+            self._clothesline = {
+                "user": user,
+                "action": action,
+                "source": source,
+                "timestamp": timestamp,
+                "version": self._clothesline.get("version", 0) + 1,
+            }
+
+    def apply_event(self, event: dict):
+        """
+        Menerapkan event "shadow" dari event bus (lihat shadow_event), sehingga
+        shadow di setiap worker ikut berubah walau perintah diterima worker lain.
+        Event lampu dengan action None menghapus lampu dari shadow.
+        """
+        timestamp = datetime.fromisoformat(event["timestamp"])
+        device = event["device"]
+        if device == "light" and event["action"] is None:
+            self.remove_light(event["light_id"])
+        elif device == "light":
+            self.update_light(event["light_id"], event["action"], event["user"], timestamp)
+        elif device == "door":
+            self.update_door(event["user"], event["action"], event["source"], timestamp)
+        elif device == "clothesline":
+            self.update_clothesline(event["action"], event["source"], event["user"], timestamp)
+
+    def get_light_state(self):
+        with self._lock:
+            return {"lights": [dict(self._lights[light_id]) for light_id in sorted(self._lights)]}
+
+    def get_light(self, light_id: int):
+        with self._lock:
+            return dict(self._lights.get(light_id, {}))
+
+    def get_door_state(self):
+        with self._lock:
+            return dict(self._door)
+
+    def get_clothesline_state(self):
+        with self._lock:
+            return dict(self._clothesline)
+
+
+def shadow_event(device: str, timestamp, **fields) -> dict:
+    return {"device": device, "timestamp": timestamp.isoformat(), **fields}
+
+
+device_shadow = DeviceShadow()
@@ -0,0 +1,123 @@
+import os
+import json
+import uuid
+import socket
+import asyncio
+import inspect
+import logging
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Backend event bus: "local" (satu worker) atau "mqtt" (banyak worker gunicorn)
+EVENT_BUS_BACKEND = os.environ.get("EVENT_BUS_BACKEND", "local")
+BUS_TOPIC_PREFIX = os.environ.get("EVENT_BUS_TOPIC_PREFIX", "homytech/_bus")
+
+
+class EventBus:
+    """
+    Event bus in-process: publish langsung memanggil semua handler lokal.
+
+    Dipakai untuk event yang harus sampai ke setiap worker, misalnya
+    broadcast WebSocket dan update device shadow. Handler boleh fungsi
+    biasa atau coroutine.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def subscribe(self, topic: str, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topic: str, data: dict):
+        await self._deliver(topic, data)
+
+    async def _deliver(self, topic: str, data: dict):
+        for handler in self._handlers.get(topic, ()):
+            try:
+                result = handler(data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Event handler for {topic} failed: {e}")
+
+
+class MqttEventBus(EventBus):
+    """
+    Event bus antar worker lewat broker MQTT.
+
+    Event dikirim ke handler lokal secara langsung, lalu dipublish ke
+    `<prefix>/<topic>` agar diterima worker lain. Setiap worker subscribe
+    ke `<prefix>/#` dengan koneksi sendiri dan mengabaikan event yang
+    berasal dari dirinya sendiri.
+    """
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.origin = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.client = mqtt.Client(client_id=f"bus_{self.origin}")
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        mqtt_user = os.environ.get("MQTT_USERNAME")
+        mqtt_pass = os.environ.get("MQTT_PASSWORD")
+        if mqtt_user and mqtt_pass:
+            self.client.username_pw_set(mqtt_user, mqtt_pass)
+
+    async def start(self):
+        broker_host = os.environ.get("MQTT_HOST", "localhost")
+        broker_port = int(os.environ.get("MQTT_PORT", "1883"))
+        # connect_async + loop_start: tidak memblokir, paho reconnect sendiri
+        self.client.connect_async(broker_host, broker_port)
+        self.client.loop_start()
+        logger.info(f"🚌 MQTT event bus started as {self.origin}")
+
+    async def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    async def publish(self, topic: str, data: dict):
+        await self._deliver(topic, data)
+        message = json.dumps({"origin": self.origin, "data": data})
+        result = self.client.publish(f"{BUS_TOPIC_PREFIX}/{topic}", message, qos=1)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning(f"⚠️ Failed to publish bus event {topic}, error code: {result.rc}")
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(f"{BUS_TOPIC_PREFIX}/#", qos=1)
+        else:
+            logger.error(f"❌ Event bus failed to connect, return code {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            event = json.loads(msg.payload.decode())
+            if event.get("origin") == self.origin:
+                return
+            topic = msg.topic[len(BUS_TOPIC_PREFIX) + 1:]
+            asyncio.run_coroutine_threadsafe(self._deliver(topic, event["data"]), self.loop)
+        except Exception as e:
+            logger.error(f"❌ Invalid bus event on {msg.topic}: {e}")
+
+
+_event_bus = None
+
+def create_event_bus(loop) -> EventBus:
+    global _event_bus
+    if EVENT_BUS_BACKEND == "mqtt":
+        _event_bus = MqttEventBus(loop)
+    elif EVENT_BUS_BACKEND == "local":
+        _event_bus = EventBus()
+    else:
+        raise ValueError(f"Unknown EVENT_BUS_BACKEND: {EVENT_BUS_BACKEND}")
+    return _event_bus
+
+async def publish_event(topic: str, data: dict):
+    await _event_bus.publish(topic, data)
@@ -0,0 +1,150 @@
+import io
+import os
+import csv
+import zlib
+import heapq
+from datetime import timezone
+
+import db_async
+from db import _build_log_query
+from serializers import LOG_SCHEMAS, LOG_PROJECTIONS, serialize_log, encode_json
+from retention import iter_archived_logs
+
+# Ukuran batch cursor MongoDB dan ukuran chunk yang dikirim ke client
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+CHUNK_SIZE = 64 * 1024
+
+EXPORT_SORT = [("timestamp", 1), ("_id", 1)]
+
+# Nama di URL -> koleksi
+EXPORT_COLLECTIONS = {
+    "door": "log_door",
+    "light": "log_light",
+    "clothesline": "log_clothesline",
+}
+
+def csv_columns(collection_name=None):
+    if collection_name:
+        return ["id", *LOG_SCHEMAS[collection_name]]
+    columns = ["type", "id"]
+    for schema in LOG_SCHEMAS.values():
+        columns += [field for field in schema if field not in columns]
+    return columns
+
+async def iter_logs(collection_name: str, query: dict, include_archive: bool = False):
+    """
+    Iterasi log satu koleksi, urut waktu naik, lewat cursor server-side.
+    Dengan `include_archive`, log yang sudah dipindah ke arsip retensi ikut digabungkan.
+    """
+    cursor = (
+        db_async.get_collection(collection_name)
+        .find(query, LOG_PROJECTIONS[collection_name])
+        .sort(EXPORT_SORT)
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    if not include_archive:
+        async for log in cursor:
+            yield log
+        return
+    sources = {"archive": iter_archived_logs(collection_name, query), "mongo": cursor}
+    async for _, log in merge_logs(sources):
+        yield log
+
+async def merge_logs(sources: dict):
+    """
+    k-way merge beberapa aliran log yang masing-masing sudah urut (timestamp, _id).
+    Yield (nama sumber, log).
+    """
+    iterators = {name: source.__aiter__() for name, source in sources.items()}
+    heap = []
+
+    async def advance(name):
+        try:
+            log = await iterators[name].__anext__()
+        except StopAsyncIteration:
+            return
+        heapq.heappush(heap, (_sort_key(log), name, log))
+
+    for name in iterators:
+        await advance(name)
+    while heap:
+        _, name, log = heapq.heappop(heap)
+        yield name, log
+        await advance(name)
+
+def _sort_key(log):
+    timestamp = log["timestamp"]
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp, str(log["_id"])
+
+async def iter_all_logs(query: dict, include_archive: bool = False):
+    """
+    Menggabungkan ketiga koleksi log menjadi satu aliran urut waktu (k-way merge).
+    Setiap log mendapat field "type" (door/light/clothesline).
+    """
+    async for name, log in merge_logs({
+        name: iter_logs(collection_name, query, include_archive)
+        for name, collection_name in EXPORT_COLLECTIONS.items()
+    }):
+        yield name, log
+
+async def _encode(rows, fmt: str, columns):
+    # rows: async iterator (type, collection_name, log mentah)
+    buffer = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+    async for kind, collection_name, log in rows:
+        row = serialize_log(collection_name, log)
+        if kind:
+            row = {"type": kind, **row}
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(encode_json(row).decode())
+            buffer.write("\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)  # wbits 31 = format gzip
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(kind: str, fmt: str = "ndjson", gzip: bool = False, include_archive: bool = False, **filters):
+    """
+    Membuat aliran bytes NDJSON/CSV untuk satu koleksi (`kind` door/light/clothesline)
+    atau gabungan semuanya (`kind` "all"). Memori tetap konstan berapa pun jumlah log
+    (log arsip dibaca per file harian).
+    """
+    if kind == "all":
+        query = _build_log_query(
+            filters.get("user"), filters.get("action"), filters.get("from_date"), filters.get("to_date")
+        )
+
+        async def rows():
+            async for name, log in iter_all_logs(query, include_archive):
+                yield name, EXPORT_COLLECTIONS[name], log
+
+        columns = csv_columns()
+    else:
+        collection_name = EXPORT_COLLECTIONS[kind]
+        query = _build_log_query(**filters)
+
+        async def rows():
+            async for log in iter_logs(collection_name, query, include_archive):
+                yield None, collection_name, log
+
+        columns = csv_columns(collection_name)
+
+    chunks = _encode(rows(), fmt, columns)
+    return _gzip(chunks) if gzip else chunks
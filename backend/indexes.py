@@ -0,0 +1,136 @@
+"""
+Provisioning index MongoDB untuk koleksi log dan users.
+
+Dipanggil dari `lifespan` saat startup (idempoten) dan bisa dijalankan manual:
+
+    python indexes.py           # buat index yang belum ada
+    python indexes.py --check   # cek query utama yang masih collection scan
+"""
+import sys
+import logging
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from db import get_collection, _build_log_query, LOG_SORT, LATEST_LIGHT_PIPELINE, LATEST_DOOR_FILTER, LOG_STORAGE_MODE
+from timeseries import ensure_timeseries_collections
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Index yang sama dipakai di mode time-series (LOG_STORAGE_MODE=timeseries):
+# MongoDB >= 6.0 mendukung secondary index pada field measurement, dan
+# (metaField, timestamp) tetap menjadi index utama untuk filter per perangkat.
+# Semua query log memfilter kesetaraan (user/action/source/light_id) lalu
+# rentang + sort (timestamp, _id) descending, jadi field kesetaraan diletakkan
+# di depan dan _id ikut di belakang untuk paginasi keyset.
+def _log_indexes(*fields):
+    indexes = [IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_desc")]
+    for field in fields:
+        indexes.append(IndexModel(
+            [(field, ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name=f"{field}_timestamp_desc",
+        ))
+    return indexes
+
+INDEX_SPECS = {
+    "log_door": _log_indexes("user", "action", "source"),
+    "log_light": _log_indexes("light_id", "user", "action"),
+    "log_clothesline": _log_indexes("user", "action", "source"),
+    "users": [IndexModel([("email", ASCENDING)], unique=True, name="email_unique")],
+    "log_daily_summary": [
+        IndexModel([("collection", ASCENDING), ("day", ASCENDING)], name="collection_day"),
+    ],
+    "light_usage_hourly": [
+        IndexModel([("light_id", ASCENDING), ("hour", ASCENDING)], unique=True, name="light_id_hour_unique"),
+        IndexModel([("hour", ASCENDING)], name="hour"),
+    ],
+}
+
+def ensure_indexes():
+    """
+    Membuat index yang dideklarasikan di INDEX_SPECS jika belum ada.
+    Return: dict {koleksi: [nama index yang baru dibuat]}.
+    """
+    created = {}
+    for collection_name, indexes in INDEX_SPECS.items():
+        collection = get_collection(collection_name)
+        existing = set(collection.index_information())
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing:
+                continue
+            try:
+                collection.create_indexes([index])
+                created.setdefault(collection_name, []).append(name)
+            except OperationFailure as e:
+                # Misalnya index dengan key sama sudah ada dengan nama lain,
+                # atau ada email duplikat sehingga unique index gagal dibuat
+                logger.error(f"Failed to create index {collection_name}.{name}: {e}")
+    if created:
+        logger.info(f"Created indexes: {created}")
+    else:
+        logger.info("All indexes already present.")
+    return created
+
+def _plan_stages(plan):
+    # Telusuri semua stage di dalam winningPlan
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def _explain_find(collection_name, query, sort=None):
+    cursor = get_collection(collection_name).find(query).limit(10)
+    if sort:
+        cursor = cursor.sort(sort)
+    explain = cursor.explain()
+    return explain.get("queryPlanner", {}).get("winningPlan", explain)
+
+def _explain_aggregate(collection_name, pipeline):
+    collection = get_collection(collection_name)
+    return collection.database.command(
+        "aggregate", collection.name, pipeline=pipeline, explain=True
+    )
+
+def check_indexes():
+    """
+    Menjalankan explain untuk pola query utama aplikasi.
+    Return: list nama query yang masih menggunakan COLLSCAN.
+    """
+    sort = LOG_SORT
+    checks = {
+        "door logs": lambda: _explain_find("log_door", _build_log_query(), sort),
+        "door logs by user": lambda: _explain_find("log_door", _build_log_query(user="-"), sort),
+        "door logs by source": lambda: _explain_find("log_door", _build_log_query(source="web"), sort),
+        "latest door state": lambda: _explain_find("log_door", LATEST_DOOR_FILTER, sort),
+        "light logs": lambda: _explain_find("log_light", _build_log_query(), sort),
+        "light logs by light_id": lambda: _explain_find("log_light", _build_log_query(light_id=1), sort),
+        "latest light state": lambda: _explain_aggregate("log_light", LATEST_LIGHT_PIPELINE),
+        "clothesline logs": lambda: _explain_find("log_clothesline", _build_log_query(), sort),
+        "clothesline logs by action": lambda: _explain_find("log_clothesline", _build_log_query(action="extend"), sort),
+        "user by email": lambda: _explain_find("users", {"email": ""}),
+    }
+    collscans = []
+    for name, explain in checks.items():
+        try:
+            stages = set(_plan_stages(explain()))
+        except OperationFailure as e:
+            logger.error(f"Explain failed for {name}: {e}")
+            continue
+        if "COLLSCAN" in stages:
+            collscans.append(name)
+            logger.warning(f"COLLSCAN: {name}")
+        else:
+            logger.info(f"OK: {name} ({', '.join(sorted(stages))})")
+    return collscans
+
+if __name__ == "__main__":
+    if LOG_STORAGE_MODE == "timeseries":
+        ensure_timeseries_collections()
+    if "--check" in sys.argv[1:]:
+        sys.exit(1 if check_indexes() else 0)
+    ensure_indexes()
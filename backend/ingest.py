@@ -0,0 +1,99 @@
+import time
+import zlib
+import asyncio
+import logging
+from collections import deque
+
+from metrics import MQTT_MESSAGE_SECONDS, MQTT_QUEUE_WAIT_SECONDS, MQTT_MESSAGES
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class IngestPipeline:
+    """
+    Pipeline pemrosesan pesan MQTT di event loop.
+
+    Callback paho hanya memanggil `submit` (memasukkan pesan mentah ke
+    antrean), lalu sejumlah worker asyncio melakukan decode, validasi,
+    penyimpanan, dan broadcast. Pesan di-shard per topic sehingga pesan
+    dari topic yang sama selalu diproses berurutan oleh worker yang sama.
+    Saat antrean shard penuh, pesan baru dibuang dan dihitung di `dropped`.
+    `label` memetakan topic ke label metrics (default: topic itu sendiri).
+    """
+
+    def __init__(self, loop, handler, workers: int = 4, queue_size: int = 1000, label=None):
+        self.loop = loop
+        self.handler = handler
+        self.label = label or (lambda topic: topic)
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks = []
+        self._latencies = deque(maxlen=1024)
+        self.counters = {"received": 0, "processed": 0, "dropped": 0, "failed": 0}
+
+    def submit(self, topic: str, payload: bytes):
+        # Dipanggil dari thread jaringan paho: jangan melakukan apa pun selain enqueue
+        self.loop.call_soon_threadsafe(self._offer, topic, payload, time.perf_counter())
+
+    def _offer(self, topic, payload, received_at):
+        self.counters["received"] += 1
+        queue = self._queues[zlib.crc32(topic.encode()) % len(self._queues)]
+        try:
+            queue.put_nowait((topic, payload, received_at))
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            MQTT_MESSAGES.labels(self.label(topic), "dropped").inc()
+            logger.warning(f"Ingest queue full, dropping message on {topic}")
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        logger.info(f"Ingest pipeline started with {len(self._tasks)} workers")
+
+    async def stop(self, timeout: float = 10.0):
+        # Selesaikan pesan yang sudah diterima sebelum worker dihentikan
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"Ingest pipeline stopped with pending messages: {self.queue_depths()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            topic, payload, received_at = await queue.get()
+            started = time.perf_counter()
+            label = self.label(topic)
+            MQTT_QUEUE_WAIT_SECONDS.labels(label).observe(started - received_at)
+            try:
+                await self.handler(topic, payload)
+                self.counters["processed"] += 1
+                MQTT_MESSAGES.labels(label, "processed").inc()
+            except Exception as e:
+                self.counters["failed"] += 1
+                MQTT_MESSAGES.labels(label, "failed").inc()
+                logger.error(f"❌ Failed to process message on {topic}: {e}")
+            finally:
+                finished = time.perf_counter()
+                MQTT_MESSAGE_SECONDS.labels(label).observe(finished - started)
+                self._latencies.append(finished - received_at)
+                queue.task_done()
+
+    def queue_depths(self):
+        return [queue.qsize() for queue in self._queues]
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {
+            **self.counters,
+            "queue_depths": self.queue_depths(),
+            "latency_p50": percentile(0.50),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,190 @@
+"""
+Rollup durasi ON lampu per jam.
+
+`light_usage_hourly` menyimpan {light_id, hour, on_seconds} untuk interval
+ON yang sudah selesai, dan `light_usage_state` menyimpan status terakhir
+setiap lampu ({_id: light_id, status, since}). Keduanya diperbarui setiap
+kali event lampu ditulis, sehingga /api/light-usage/hourly cukup membaca
+rollup ditambah interval yang masih ON.
+
+Untuk membangun ulang rollup dari riwayat log_light:
+
+    python light_usage.py backfill
+"""
+import os
+import re
+import sys
+import logging
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne, ReturnDocument
+
+import db
+import db_async
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+HOURLY_COLLECTION = "light_usage_hourly"
+STATE_COLLECTION = "light_usage_state"
+# Lampu yang selalu ditampilkan di chart walaupun belum punya data. Lampu lain
+# muncul otomatis begitu punya status di light_usage_state (perintah web atau feedback MQTT).
+DEFAULT_LIGHT_IDS = [int(light_id) for light_id in os.environ.get("LIGHT_DEFAULT_IDS", "1,2,3").split(",") if light_id.strip()]
+MAX_WINDOW = timedelta(days=90)
+
+def _as_utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def floor_hour(dt):
+    return _as_utc(dt).replace(minute=0, second=0, microsecond=0)
+
+def split_by_hour(start, end):
+    """
+    Memecah interval [start, end) menjadi list (awal_jam, detik) per jam UTC.
+    """
+    start, end = _as_utc(start), _as_utc(end)
+    segments = []
+    while start < end:
+        hour_end = floor_hour(start) + timedelta(hours=1)
+        segment_end = min(end, hour_end)
+        segments.append((floor_hour(start), (segment_end - start).total_seconds()))
+        start = segment_end
+    return segments
+
+def parse_window(window: str) -> timedelta:
+    """
+    Mengubah string seperti "8h", "24h", "7d", "30d" menjadi timedelta.
+    Raise ValueError jika format tidak dikenali atau melebihi MAX_WINDOW.
+    """
+    match = re.fullmatch(r"(\d+)([hd])", window)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Window tidak valid: {window}")
+    amount = int(match.group(1))
+    delta = timedelta(hours=amount) if match.group(2) == "h" else timedelta(days=amount)
+    if delta > MAX_WINDOW:
+        raise ValueError(f"Window maksimal {MAX_WINDOW.days}d")
+    return delta
+
+# --- Update inkremental ---
+def _state_update(action: str, timestamp):
+    # Saat lampu sudah ON dan menerima ON lagi, `since` tetap dipertahankan
+    return [{"$set": {
+        "since": {"$cond": [
+            {"$and": [{"$eq": ["$status", "on"]}, {"$eq": [action, "on"]}]},
+            "$since",
+            timestamp,
+        ]},
+        "status": action,
+    }}]
+
+def _rollup_ops(light_id: int, previous: dict, action: str, timestamp):
+    # Interval ON ditutup hanya saat transisi on -> off
+    if not previous or previous.get("status") != "on" or action != "off":
+        return []
+    return [
+        UpdateOne(
+            {"light_id": light_id, "hour": hour},
+            {"$inc": {"on_seconds": seconds}},
+            upsert=True,
+        )
+        for hour, seconds in split_by_hour(previous["since"], timestamp)
+    ]
+
+async def record_light_event_async(light_id: int, action: str, timestamp):
+    if action not in ("on", "off"):
+        return
+    try:
+        previous = await db_async.get_collection(STATE_COLLECTION).find_one_and_update(
+            {"_id": light_id},
+            _state_update(action, timestamp),
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        ops = _rollup_ops(light_id, previous, action, timestamp)
+        if ops:
+            await db_async.get_collection(HOURLY_COLLECTION).bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Error updating light usage rollup: {e}")
+
+# --- Pembacaan ---
+async def get_hourly_usage(window: timedelta, now=None, tz=timezone.utc):
+    """
+    Total menit ON per jam per lampu untuk `window` terakhir (termasuk jam berjalan).
+    Return: list {"hour": "HH:MM", "light1": menit, ...} urut dari jam paling lama.
+    """
+    now = _as_utc(now or datetime.now(timezone.utc))
+    hours = max(1, int(window.total_seconds() // 3600))
+    from_hour = floor_hour(now) - timedelta(hours=hours - 1)
+
+    usage = {}
+    cursor = db_async.get_collection(HOURLY_COLLECTION).find(
+        {"hour": {"$gte": from_hour, "$lte": now}},
+        {"_id": 0, "light_id": 1, "hour": 1, "on_seconds": 1},
+    )
+    async for doc in cursor:
+        key = (doc["light_id"], _as_utc(doc["hour"]))
+        usage[key] = usage.get(key, 0) + doc["on_seconds"]
+
+    # Interval yang masih ON belum masuk rollup, hitung sampai sekarang
+    light_ids = set(DEFAULT_LIGHT_IDS)
+    async for state in db_async.get_collection(STATE_COLLECTION).find({}):
+        light_ids.add(state["_id"])
+        if state.get("status") != "on" or not state.get("since"):
+            continue
+        start = max(_as_utc(state["since"]), from_hour)
+        for hour, seconds in split_by_hour(start, now):
+            key = (state["_id"], hour)
+            usage[key] = usage.get(key, 0) + seconds
+    light_ids.update(light_id for light_id, _ in usage)
+
+    data = []
+    for i in range(hours):
+        hour = from_hour + timedelta(hours=i)
+        label = "%H:%M" if hours <= 24 else "%d/%m %H:%M"
+        row = {"hour": hour.astimezone(tz).strftime(label)}
+        for light_id in sorted(light_ids):
+            row[f"light{light_id}"] = min(60, int(usage.get((light_id, hour), 0) // 60))
+        data.append(row)
+    return data
+
+# --- Backfill ---
+def backfill():
+    """
+    Membangun ulang rollup dan status lampu dari seluruh riwayat log_light.
+    """
+    hourly = {}
+    states = {}
+    cursor = db.get_collection("log_light").find(
+        {"action": {"$in": ["on", "off"]}},
+        {"_id": 0, "light_id": 1, "action": 1, "timestamp": 1},
+    ).sort("timestamp", 1).batch_size(5000)
+    count = 0
+    for log in cursor:
+        count += 1
+        light_id, action, timestamp = log["light_id"], log["action"], _as_utc(log["timestamp"])
+        previous = states.get(light_id)
+        if previous and previous["status"] == "on":
+            if action == "on":
+                continue
+            for hour, seconds in split_by_hour(previous["since"], timestamp):
+                hourly[(light_id, hour)] = hourly.get((light_id, hour), 0) + seconds
+        states[light_id] = {"_id": light_id, "status": action, "since": timestamp}
+
+    db.get_collection(HOURLY_COLLECTION).delete_many({})
+    db.get_collection(STATE_COLLECTION).delete_many({})
+    if hourly:
+        db.get_collection(HOURLY_COLLECTION).insert_many([
+            {"light_id": light_id, "hour": hour, "on_seconds": seconds}
+            for (light_id, hour), seconds in hourly.items()
+        ])
+    if states:
+        db.get_collection(STATE_COLLECTION).insert_many(list(states.values()))
+    logger.info(f"Backfilled {len(hourly)} hourly rollups for {len(states)} lights from {count} logs")
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        backfill()
+    else:
+        print("Usage: python light_usage.py backfill")
+        sys.exit(1)
@@ -0,0 +1,143 @@
+import queue
+import threading
+import time
+import logging
+
+from pymongo.errors import BulkWriteError
+
+from metrics import DB_OPERATION_SECONDS
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class BatchLogWriter:
+    """
+    Menulis log perangkat secara berbatch.
+
+    Setiap koleksi punya antrean terbatas dan thread flusher sendiri. Batch
+    dikirim dengan `insert_many` saat jumlahnya mencapai `batch_size` atau
+    saat `flush_interval` detik berlalu sejak dokumen pertama masuk batch.
+    Saat antrean penuh, `submit` menunggu paling lama `block_timeout` detik
+    (backpressure) lalu membuang dokumen tersebut (shedding).
+    """
+
+    def __init__(self, get_collection, collections, batch_size=200, flush_interval=1.0,
+                 max_queue_size=10000, block_timeout=0.5, max_retries=3):
+        self.get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+
+        self._queues = {name: queue.Queue(maxsize=max_queue_size) for name in collections}
+        self._threads = []
+        self._stopping = threading.Event()
+        self.stats = {
+            name: {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+            for name in collections
+        }
+
+    def start(self):
+        for name in self._queues:
+            thread = threading.Thread(
+                target=self._run, args=(name,), name=f"log-writer-{name}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(
+            f"Batch log writer started (batch_size={self.batch_size}, "
+            f"flush_interval={self.flush_interval}s)"
+        )
+
+    def submit(self, collection_name: str, doc: dict, block: bool = True) -> bool:
+        """
+        Memasukkan dokumen ke antrean koleksi.
+        `block=False` dipakai dari event loop agar tidak pernah menunggu.
+        Return False jika dokumen dibuang karena antrean penuh.
+        """
+        q = self._queues[collection_name]
+        try:
+            if block:
+                q.put(doc, timeout=self.block_timeout)
+            else:
+                q.put_nowait(doc)
+            return True
+        except queue.Full:
+            self.stats[collection_name]["dropped"] += 1
+            logger.warning(f"Log queue {collection_name} penuh, dokumen dibuang")
+            return False
+
+    def queue_depth(self, collection_name: str) -> int:
+        return self._queues[collection_name].qsize()
+
+    def stop(self, timeout: float = 10.0):
+        # Thread flusher menguras antrean sampai kosong sebelum berhenti
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        pending = {name: q.qsize() for name, q in self._queues.items() if q.qsize()}
+        if pending:
+            logger.error(f"Batch log writer berhenti dengan log tersisa: {pending}")
+        else:
+            logger.info("Batch log writer drained and stopped.")
+
+    def _run(self, name: str):
+        q = self._queues[name]
+        while True:
+            try:
+                doc = q.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+
+            batch = [doc]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(name, batch)
+
+    def _flush(self, name: str, batch: list):
+        # _id sudah terisi sejak percobaan pertama, jadi dokumen yang ternyata sudah
+        # tersimpan gagal dengan duplicate key saat diulang dan dihitung sebagai tertulis
+        pending = batch
+        written = 0
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with DB_OPERATION_SECONDS.labels(f"insert_many:{name}").time():
+                    self.get_collection(name).insert_many(pending, ordered=False)
+                written += len(pending)
+                pending = []
+            except BulkWriteError as e:
+                retry = [
+                    pending[error["index"]] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                ]
+                if e.details.get("writeConcernErrors"):
+                    retry = pending
+                written += len(pending) - len(retry)
+                pending = retry
+                if pending:
+                    logger.warning(f"Flush {name} attempt {attempt}/{self.max_retries}: {len(pending)} docs failed")
+            except Exception as e:
+                logger.warning(f"Flush {name} attempt {attempt}/{self.max_retries} failed: {e}")
+            if not pending:
+                break
+            if attempt < self.max_retries and not self._stopping.is_set():
+                time.sleep(0.5 * attempt)
+
+        self.stats[name]["written"] += written
+        if written:
+            self.stats[name]["batches"] += 1
+            logger.debug(f"Flushed {written} docs to {name}")
+        if pending:
+            self.stats[name]["failed"] += len(pending)
+            logger.error(f"Gagal menulis {len(pending)} log ke {name}")
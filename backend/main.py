@@ -1,14 +1,32 @@
-from bson import ObjectId
-from fastapi import FastAPI, HTTPException, WebSocket, Query, Depends, Body
+from fastapi import FastAPI, HTTPException, WebSocket, Query, Depends, Body, Header
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from fastapi.responses import JSONResponse
 from datetime import datetime, timezone, timedelta
-from typing import Optional
-from mqtt_client import MQTTClientManager
+from typing import Optional, Literal
+from mqtt_client import MQTTClientManager, PublishError
+from serializers import JAKARTA_TZ, FastJSONResponse, serialize_state
+from exports import export_stream, EXPORT_COLLECTIONS
+from db import start_log_writer, stop_log_writer, current_utc_time, LOG_STORAGE_MODE, close_client
+from db import ping as ping_mongo_sync
+from device_shadow import device_shadow, shadow_event
+from event_bus import create_event_bus, publish_event
+from auth_cache import principal_cache
+from light_usage import parse_window, get_hourly_usage, record_light_event_async
+from indexes import ensure_indexes
+from metrics import registry, AUTH_SECONDS
+from tracing import TracingMiddleware, span, recent_traces
+from profiler import PROFILER_ENABLED, sample_stacks, render_collapsed
+from timeseries import ensure_timeseries_collections
+from retention import RETENTION_ENABLED, retention_loop, get_daily_summaries
+from password_hashing import password_hasher, hash_password, verify_password, PasswordHasherBusy
+import analytics
 from contextlib import asynccontextmanager
-from db import (
+from db_async import (
+    close_async_client,
+    warm_up as warm_up_mongo,
+    ping as ping_mongo,
     insert_light_log, 
     insert_door_log, 
     insert_clothesline_log, 
@@ -20,8 +38,14 @@ from db import (
     get_light_logs,
     get_clothesline_logs,
     get_user_by_email,
+    register_user,
+    update_password_hash,
 )
 from websocket_manager import (
+    connect_client,
+    disconnect_client,
+    subscribe,
+    handle_client_message,
     connect_client_light,
     connect_client_door,
     connect_client_clothesline,
@@ -30,16 +54,17 @@ from websocket_manager import (
     disconnect_client_door,
     disconnect_client_clothesline,
     disconnect_client_alert,
-    broadcast_light_status,
-    broadcast_door_status,
-    broadcast_clothesline_status,
+    broadcast,
+    TOPICS,
 )
 from jose import jwt
-from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 import logging
 import sys
 import os
 import asyncio
+import time
+from functools import partial
 
 mqtt_manager = None  
 
@@ -54,35 +79,44 @@ logging.basicConfig(
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 ALGORITHM = os.environ.get("JWT_ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-JAKARTA_TZ = timezone(timedelta(hours=7))
-
-def to_jakarta_time(dt):
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(JAKARTA_TZ)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "2.0"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def resolve_principal(email: str):
+    """
+    Mengambil user untuk `sub` token, lewat principal_cache sebelum ke MongoDB.
+    """
+    with AUTH_SECONDS.labels("principal_lookup").time(), span("auth.principal_lookup"):
+        user = principal_cache.get(email)
+        if user is not None:
+            return user
+        user = await get_user_by_email(email)
+        if user is None:
+            return None
+        return principal_cache.set(email, user)
+
+def decode_token_subject(token: str):
+    # Return `sub` dari JWT, atau None jika token tidak valid
+    with AUTH_SECONDS.labels("jwt_decode").time(), span("auth.jwt_decode"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.JWTError:
+            return None
+    return payload.get("sub")
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except jwt.JWTError:
+    email = decode_token_subject(token)
+    if email is None:
         raise credentials_exception
-    
-    user = get_user_by_email(email)
+
+    user = await resolve_principal(email)
     if user is None:
         raise credentials_exception
     return user
@@ -92,55 +126,97 @@ async def get_current_user_ws(token: str = Query(...)):
         status_code=401,
         detail="Could not validate credentials",
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except jwt.JWTError:
+    email = decode_token_subject(token)
+    if email is None:
         raise credentials_exception
-    
-    user = get_user_by_email(email)
+
+    user = await resolve_principal(email)
     if user is None:
         raise credentials_exception
     return user
 
 
 
-def convert_mongo_types(obj, to_jakarta=False):
-    if isinstance(obj, dict):
-        return {k: convert_mongo_types(v, to_jakarta) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_mongo_types(i, to_jakarta) for i in obj]
-    elif isinstance(obj, ObjectId):
-        return str(obj)
-    elif isinstance(obj, datetime):
-        if to_jakarta:
-            return to_jakarta_time(obj).isoformat()
-        return obj.isoformat()
-    elif isinstance(obj, str):
-        # Try to parse ISO datetime string and convert if needed
-        try:
-            dt = datetime.fromisoformat(obj)
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            if to_jakarta:
-                return to_jakarta_time(dt).isoformat()
-            return dt.isoformat()
-        except Exception:
-            return obj
-    else:
-        return obj
+async def load_device_shadow():
+    device_shadow.load(*await asyncio.gather(
+        get_latest_light_state(),
+        get_latest_door_state(),
+        get_latest_clothesline_state(),
+    ))
 
+async def retry_device_shadow_load(max_delay: float = 30.0):
+    delay = 1.0
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await load_device_shadow()
+            logger.info("✅ Device shadow loaded after retry")
+            return
+        except Exception as e:
+            delay = min(delay * 2, max_delay)
+            logger.error(f"❌ Device shadow load failed, retrying in {delay:.0f}s: {e}")
+
+def require_device_shadow():
+    # Tanpa shadow, latest-state akan kosong dan sync-state tidak mengirim apa pun
+    if not device_shadow.loaded:
+        raise HTTPException(status_code=503, detail="Status perangkat belum dimuat dari database", headers={"Retry-After": "5"})
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global mqtt_manager
     loop = asyncio.get_running_loop()
+    # Client MongoDB dibuat di sini (setelah fork worker), lalu pool dipanaskan.
+    # Kalau MongoDB belum bisa dijangkau, startup tetap lanjut dan /api/health/ready melaporkan 503.
+    try:
+        await asyncio.gather(warm_up_mongo(), run_in_threadpool(ping_mongo_sync))
+        logger.info("✅ MongoDB connection pool warmed up")
+    except Exception as e:
+        logger.error(f"❌ MongoDB warm-up failed: {e}")
+    if LOG_STORAGE_MODE == "timeseries":
+        # Harus ada sebelum insert/create_index pertama, jika tidak terbentuk koleksi biasa
+        try:
+            await run_in_threadpool(ensure_timeseries_collections)
+        except Exception as e:
+            logger.error(f"❌ Time-series collection setup failed: {e}")
+    if os.environ.get("MONGO_ENSURE_INDEXES", "true").lower() == "true":
+        try:
+            await run_in_threadpool(ensure_indexes)
+        except Exception as e:
+            logger.error(f"Index provisioning failed: {e}")
+    start_log_writer()
+    # Muat status terakhir semua perangkat ke device shadow sebelum menerima MQTT.
+    # Jika MongoDB belum siap, dicoba lagi di background; /api/health/ready 503 sampai berhasil.
+    shadow_task = None
+    try:
+        await load_device_shadow()
+    except Exception as e:
+        logger.error(f"❌ Device shadow load failed, retrying in background: {e}")
+        shadow_task = asyncio.create_task(retry_device_shadow_load())
+    # Event bus: broadcast WebSocket, device shadow, dan invalidasi auth di semua worker
+    event_bus = create_event_bus(loop)
+    for topic in TOPICS:
+        event_bus.subscribe(topic, partial(broadcast, topic))
+    event_bus.subscribe("shadow", device_shadow.apply_event)
+    event_bus.subscribe("auth_invalidate", lambda event: principal_cache.invalidate(event["email"]))
+    await event_bus.start()
     mqtt_manager = MQTTClientManager(loop)
+    await mqtt_manager.pipeline.start()
+    # Tidak menunggu broker: koneksi dan reconnect berjalan di thread supervisor
     mqtt_manager.connect()
+    retention_task = asyncio.create_task(retention_loop()) if RETENTION_ENABLED else None
     yield
+    if retention_task:
+        retention_task.cancel()
+    if shadow_task:
+        shadow_task.cancel()
     mqtt_manager.stop()
+    await mqtt_manager.pipeline.stop()
+    await event_bus.stop()
+    # Kuras semua log yang masih di antrean sebelum koneksi DB ditutup
+    await run_in_threadpool(stop_log_writer)
+    await close_async_client()
+    close_client()
+    password_hasher.shutdown()
     logger.info("Aplikasi dihentikan, koneksi MQTT ditutup.")
 
 app = FastAPI(lifespan=lifespan)
@@ -159,7 +235,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Tracing sampled (TRACE_SAMPLE_RATE atau header X-Trace: 1); no-op untuk request lain
+app.add_middleware(TracingMiddleware)
 
+@app.websocket("/ws")
+async def websocket_multiplexed(websocket: WebSocket, topics: str = "", user: dict = Depends(get_current_user_ws)):
+    """
+    Satu koneksi untuk semua topic (light, door, clothesline, alert).
+    Subscription awal bisa lewat ?topics=light,door; selanjutnya client mengirim
+    {"op": "subscribe"|"unsubscribe", "topic": ..., "filter": {...}}.
+    Pesan dikirim sebagai {"topic": ..., "data": {...}}.
+    Topic tidak dikenal di ?topics= ditutup dengan kode 1008 beserta alasannya.
+    """
+    requested = [topic.strip() for topic in topics.split(",") if topic.strip()]
+    unknown = [topic for topic in requested if topic not in TOPICS]
+    if unknown:
+        await websocket.accept()
+        await websocket.close(code=1008, reason=f"Unknown topic: {', '.join(unknown)}")
+        return
+    connection = await connect_client(websocket, multiplexed=True)
+    try:
+        for topic in requested:
+            subscribe(connection, topic)
+        while True:
+            handle_client_message(connection, await websocket.receive_text())
+    except:
+        disconnect_client(websocket)
+
+# Endpoint per-topic lama tetap ada untuk kompatibilitas dashboard
 @app.websocket("/ws/light")
 async def websocket_light(websocket: WebSocket, user: dict = Depends(get_current_user_ws)):
     await connect_client_light(websocket)
@@ -196,6 +299,86 @@ async def websocket_alert(websocket: WebSocket, user: dict = Depends(get_current
     except:
         disconnect_client_alert(websocket)
 
+# Pipeline ingest dibuat di lifespan, jadi dibaca lewat global mqtt_manager saat scrape
+registry.callback(
+    "homytech_mqtt_ingest_queue_depth", "Inbound MQTT messages waiting per ingest worker",
+    lambda: {(str(i),): depth for i, depth in enumerate(mqtt_manager.pipeline.queue_depths())}, ["worker"],
+)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """
+    Metrics format teks Prometheus. Tidak lewat nginx (/api/); di-scrape langsung
+    dari backend:8000. Jika METRICS_TOKEN diset, scraper wajib mengirim Bearer token tsb.
+    """
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/health/live")
+async def health_live():
+    # Proses hidup dan event loop merespons
+    return {"status": "ok"}
+
+@app.get("/api/health/ready")
+async def health_ready():
+    """
+    Siap menerima trafik jika MongoDB menjawab ping, client MQTT terhubung ke broker,
+    dan device shadow sudah dimuat.
+    Return 503 beserta detail pengecekan jika salah satunya gagal.
+    """
+    checks = {}
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(ping_mongo(), HEALTH_CHECK_TIMEOUT)
+        checks["mongodb"] = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except Exception as e:
+        checks["mongodb"] = {"ok": False, "error": type(e).__name__}
+    checks["mqtt"] = mqtt_manager.connection_status() if mqtt_manager is not None else {"ok": False}
+    checks["device_shadow"] = {"ok": device_shadow.loaded}
+    ready = all(check["ok"] for check in checks.values())
+    return FastJSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/api/debug/traces")
+async def get_recent_traces(limit: int = Query(20, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    """
+    Trace terakhir yang di-sample di worker ini (terbaru dulu).
+    """
+    return FastJSONResponse({"pid": os.getpid(), "traces": list(recent_traces)[-limit:][::-1]})
+
+@app.get("/api/debug/profile")
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=60),
+    interval: float = Query(0.005, ge=0.001, le=1),
+    format: Literal["collapsed", "json"] = "collapsed",
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Profil statistik worker yang menjawab request ini selama `seconds` detik.
+    Format "collapsed" bisa langsung dibuka di speedscope / flamegraph.pl.
+    Hanya aktif jika PROFILER_ENABLED=true.
+    """
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler tidak aktif")
+    try:
+        profile = await run_in_threadpool(sample_stacks, seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    headers = {"X-Profile-Pid": str(os.getpid()), "X-Profile-Samples": str(profile["samples"])}
+    if format == "json":
+        return FastJSONResponse({"pid": os.getpid(), **profile}, headers=headers)
+    return PlainTextResponse(render_collapsed(profile["stacks"]), headers=headers)
+
+@app.get("/api/ingest/stats")
+async def get_ingest_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Kedalaman antrean dan latensi pemrosesan pipeline ingest MQTT (detik).
+    """
+    return mqtt_manager.pipeline.stats()
+
 class DeviceControlRequest(BaseModel):
     user: str
     action: str
@@ -210,19 +393,35 @@ async def control_light(light_id: int, req: DeviceControlRequest, current_user:
         raise HTTPException(status_code=400, detail="action harus on atau off")
     
     topic = f"homytech/light/{light_id}/web"
-    result = publish(topic, {"action": action})
-    
-    if result.rc != 0:
-        raise HTTPException(status_code=500, detail="Gagal mengirim perintah ke broker MQTT")
+    # Shadow diperbarui sebelum perintah dikirim, agar feedback lampu (handle_light) di worker
+    # mana pun dikenali sebagai konfirmasi dan tidak dicatat/di-broadcast dua kali
+    previous = device_shadow.get_light(light_id)
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("light", timestamp, light_id=light_id, action=action, user=req.user))
+    expected = device_shadow.get_light(light_id)
+    try:
+        await publish_command(topic, {"action": action})
+    except Exception:
+        # Kembalikan status lama (atau hapus jika belum ada), kecuali sudah ditimpa perintah/feedback yang lebih baru
+        if device_shadow.get_light(light_id).get("version") == expected["version"]:
+            if previous.get("action"):
+                await publish_event("shadow", shadow_event(
+                    "light", previous["timestamp"] or timestamp, light_id=light_id,
+                    action=previous["action"], user=previous["user"],
+                ))
+            else:
+                await publish_event("shadow", shadow_event("light", timestamp, light_id=light_id, action=None, user=None))
+        raise
     
-    await broadcast_light_status({
+    await publish_event("light", {
         "user": req.user,
         "light_id": light_id,
         "action": action,
         "timestamp": datetime.now().isoformat(),
     })
     
-    insert_light_log(light_id, action, req.user)
+    await insert_light_log(light_id, action, req.user, timestamp)
+    await record_light_event_async(light_id, action, timestamp)
     return {"message": f"light {light_id} dikirim perintah {action}"}
 
 @app.post("/api/door/")
@@ -232,19 +431,18 @@ async def control_door(req: DeviceControlRequest, current_user: dict = Depends(g
         raise HTTPException(status_code=400, detail="action harus open atau close")
     
     topic = "homytech/door/web"
-    result = publish(topic, {"action": action})
-    
-    if result.rc != 0:  
-        raise HTTPException(status_code=500, detail="Gagal mengirim perintah ke broker MQTT")
+    await publish_command(topic, {"action": action})
     
-    await broadcast_door_status({
+    await publish_event("door", {
         "user": req.user,
         "action": action,
         "timestamp": datetime.now().isoformat(),
         "source": "web"
     })
 
-    insert_door_log(req.user, action, "web")
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("door", timestamp, user=req.user, action=action, source="web"))
+    await insert_door_log(req.user, action, "web", timestamp)
     return {"message": f"door dikirim perintah {action}"}
 
 @app.post("/api/clothesline/")
@@ -254,19 +452,18 @@ async def control_clothesline(req: DeviceControlRequest, current_user: dict = De
         raise HTTPException(status_code=400, detail="action harus retract atau extend")
     
     topic = "homytech/clothesline/web"
-    result = publish(topic, {"action": action})
+    await publish_command(topic, {"action": action})
     
-    if result.rc != 0:  
-        raise HTTPException(status_code=500, detail="Gagal mengirim perintah ke broker MQTT")
-    
-    await broadcast_clothesline_status({
+    await publish_event("clothesline", {
         "user": req.user,
         "action": action,
         "timestamp": datetime.now().isoformat(),
         "source": "web",
     })
 
-    insert_clothesline_log(action, "web", req.user)
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("clothesline", timestamp, user=req.user, action=action, source="web"))
+    await insert_clothesline_log(action, "web", req.user, timestamp)
     return {"message": f"clothesline dikirim perintah {action}"}
 
 @app.post("/api/clothesline/mode")
@@ -276,77 +473,84 @@ async def control_clothesline_mode(req: ModeControlRequest, current_user: dict =
         raise HTTPException(status_code=400, detail="mode harus manual atau auto")
     
     topic = "homytech/clothesline-mode/web"
-    result = publish(topic, {"mode": mode})
-
-    if result.rc != 0:  
-        raise HTTPException(status_code=500, detail="Gagal mengirim perintah ke broker MQTT")
+    await publish_command(topic, {"mode": mode})
 
     return {"message": f"clothesline berada pada mode {mode}"}
 
 
 @app.post("/api/sync-state")
 async def sync_state(current_user: dict = Depends(get_current_user)):
+    require_device_shadow()
     try:
-        # Fetch latest states
-        light_state = get_latest_light_state()
-        door_state = get_latest_door_state()
-        clothesline_state = get_latest_clothesline_state()
+        # Ambil status terakhir dari device shadow
+        light_state = device_shadow.get_light_state()
+        door_state = device_shadow.get_door_state()
+        clothesline_state = device_shadow.get_clothesline_state()
 
-        # Publish to MQTT
+        # Publish semua status sekaligus dan tunggu konfirmasinya bersamaan
+        messages = []
         if light_state and "lights" in light_state:
             for light in light_state["lights"]:
                 topic = f"homytech/light/{light['light_id']}/web"
-                publish(topic, {"action": light["action"]})
+                messages.append((topic, {"action": light["action"]}))
         if door_state:
-            publish("homytech/door/web", {"action": door_state["action"]})
+            messages.append(("homytech/door/web", {"action": door_state["action"]}))
         if clothesline_state:
-            publish("homytech/clothesline/web", {"action": clothesline_state["action"]})
-        
-        publish("homytech/clothesline-mode/web", {"mode": "auto"})
-        
+            messages.append(("homytech/clothesline/web", {"action": clothesline_state["action"]}))
+        messages.append(("homytech/clothesline-mode/web", {"mode": "auto"}))
+
+        results = await mqtt_manager.publish_many(messages)
+        failed = [topic for (topic, _), result in zip(messages, results) if isinstance(result, Exception)]
+        if failed:
+            logger.error(f"Sync state not confirmed for topics: {failed}")
+            raise HTTPException(status_code=500, detail="Failed to sync state")
+
         return {"message": "State synchronized to IoT devices via MQTT"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error syncing state: {e}")
         raise HTTPException(status_code=500, detail="Failed to sync state")
 
 @app.get("/api/latest-state/light")
-def get_light_state(current_user: dict = Depends(get_current_user)):
+async def get_light_state(current_user: dict = Depends(get_current_user)):
+    require_device_shadow()
     try:
-        state = get_latest_light_state()
+        state = device_shadow.get_light_state()
         if state is None:
             raise HTTPException(status_code=404, detail="Tidak ada data status lampu")
-        state = convert_mongo_types(state, to_jakarta=True)
-        return JSONResponse(content=state)
+        state = {"lights": [serialize_state(light) for light in state["lights"]]}
+        return FastJSONResponse(content=state)
     except Exception as e:
         logger.error(f"Error in get_light_state: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 @app.get("/api/latest-state/door")
-def get_door_state(current_user: dict = Depends(get_current_user)):
+async def get_door_state(current_user: dict = Depends(get_current_user)):
+    require_device_shadow()
     try:
-        state = get_latest_door_state()
+        state = device_shadow.get_door_state()
         if state is None:
             raise HTTPException(status_code=404, detail="Tidak ada data status pintu")
-        state = convert_mongo_types(state, to_jakarta=True)
-        return JSONResponse(content=state)
+        return FastJSONResponse(content=serialize_state(state))
     except Exception as e:
         logger.error(f"Error in get_door_state: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
     
 @app.get("/api/latest-state/clothesline")
-def get_clothesline_state(current_user: dict = Depends(get_current_user)):
+async def get_clothesline_state(current_user: dict = Depends(get_current_user)):
+    require_device_shadow()
     try:
-        state = get_latest_clothesline_state()
+        state = device_shadow.get_clothesline_state()
         if state is None:
             raise HTTPException(status_code=404, detail="Tidak ada data status jemuran")
-        state = convert_mongo_types(state, to_jakarta=True)
-        return JSONResponse(content=state)
+        return FastJSONResponse(content=serialize_state(state))
     except Exception as e:
         logger.error(f"Error in get_clothesline_state: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 @app.get("/api/logs/door")
-def api_get_door_logs(
+async def api_get_door_logs(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
     user: Optional[str] = None,
@@ -354,19 +558,21 @@ def api_get_door_logs(
     source: Optional[str] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    count: Literal["exact", "estimated", "none"] = "exact",
     current_user: dict = Depends(get_current_user)
 ):
     try:
-        logs = get_door_logs(page, limit, user, action, source, from_date, to_date)
-        # Convert timestamps to Jakarta time before returning
-        logs["logs"] = [convert_mongo_types(log, to_jakarta=True) for log in logs["logs"]]
-        return logs
+        logs = await get_door_logs(page, limit, user, action, source, from_date, to_date, cursor, count)
+        return FastJSONResponse(content=logs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching door logs: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch door logs")
 
 @app.get("/api/logs/light")
-def api_get_light_logs(
+async def api_get_light_logs(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=1000),
     user: Optional[str] = None,
@@ -374,20 +580,23 @@ def api_get_light_logs(
     light_id: Optional[int] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    count: Literal["exact", "estimated", "none"] = "exact",
     current_user: dict = Depends(get_current_user)
 ): 
-    logger.info(f"API /api/logs/light called with params: page={page}, limit={limit}, user={user}, action={action}, light_id={light_id}, from_date={from_date}, to_date={to_date}")
+    logger.info(f"API /api/logs/light called with params: page={page}, limit={limit}, user={user}, action={action}, light_id={light_id}, from_date={from_date}, to_date={to_date}, cursor={cursor}, count={count}")
     try:
-        logs = get_light_logs(page, limit, user, action, light_id, from_date, to_date)
-        logs["logs"] = [convert_mongo_types(log, to_jakarta=True) for log in logs["logs"]]
+        logs = await get_light_logs(page, limit, user, action, light_id, from_date, to_date, cursor, count)
         logger.info(f"Successfully fetched {len(logs['logs'])} light logs")
-        return logs
+        return FastJSONResponse(content=logs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching light logs: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to fetch light logs: {e}")
 
 @app.get("/api/logs/clothesline")
-def api_get_clothesline_logs(
+async def api_get_clothesline_logs(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
     user: Optional[str] = None,
@@ -395,23 +604,83 @@ def api_get_clothesline_logs(
     source: Optional[str] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    count: Literal["exact", "estimated", "none"] = "exact",
     current_user: dict = Depends(get_current_user)
 ):
     try:
-        logs = get_clothesline_logs(page, limit, user, action, source, from_date, to_date)
-        logs["logs"] = [convert_mongo_types(log, to_jakarta=True) for log in logs["logs"]]
-        return logs
+        logs = await get_clothesline_logs(page, limit, user, action, source, from_date, to_date, cursor, count)
+        return FastJSONResponse(content=logs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching clothesline logs: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch clothesline logs")
 
+@app.get("/api/export/{kind}")
+async def api_export_logs(
+    kind: Literal["door", "light", "clothesline", "all"],
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    gzip: bool = False,
+    include_archive: bool = False,
+    user: Optional[str] = None,
+    action: Optional[str] = None,
+    source: Optional[str] = None,
+    light_id: Optional[int] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Export log lengkap sebagai NDJSON atau CSV lewat streaming, urut waktu naik.
+    `kind=all` menggabungkan log pintu, lampu, dan jemuran dengan kolom "type".
+    `include_archive=true` ikut membaca log lama yang sudah dipindah ke arsip retensi.
+    """
+    # Filter yang tidak berlaku untuk kind ini ditolak, bukan diabaikan diam-diam
+    if source is not None and kind not in ("door", "clothesline"):
+        raise HTTPException(status_code=400, detail="source hanya berlaku untuk kind door atau clothesline")
+    if light_id is not None and kind != "light":
+        raise HTTPException(status_code=400, detail="light_id hanya berlaku untuk kind light")
+
+    filters = {"user": user, "action": action, "from_date": from_date, "to_date": to_date}
+    if kind in ("door", "clothesline"):
+        filters["source"] = source
+    elif kind == "light":
+        filters["light_id"] = light_id
+
+    filename = f"homytech-{kind}-logs.{fmt}" + (".gz" if gzip else "")
+    if gzip:
+        media_type = "application/gzip"
+    else:
+        media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return StreamingResponse(
+        export_stream(kind, fmt, gzip, include_archive, **filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/logs/daily-summary/{kind}")
+async def api_get_daily_summary(
+    kind: Literal["door", "light", "clothesline"],
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Ringkasan harian (UTC) log yang sudah melewati masa retensi: jumlah per action/user/perangkat.
+    """
+    return FastJSONResponse({"data": await get_daily_summaries(EXPORT_COLLECTIONS[kind], from_date, to_date)})
+
 class LoginRequest(BaseModel):
     email: str
     password: str
 
 @app.post("/api/login")
-def login(req: LoginRequest = Body(...)):
-    user = authenticate_user(req.email, req.password)
+async def login(req: LoginRequest = Body(...)):
+    try:
+        user = await authenticate_user(req.email, req.password)
+    except PasswordHasherBusy:
+        raise password_busy_error()
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     access_token = create_access_token({"sub": user["email"]})
@@ -419,120 +688,81 @@ def login(req: LoginRequest = Body(...)):
 
 
 @app.get("/api/light-usage/hourly")
-def get_light_usage_hourly(current_user: dict = Depends(get_current_user)):
+async def get_light_usage_hourly(
+    window: str = Query("8h", description="Rentang waktu, mis. 8h, 24h, 7d, 30d"),
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Mengembalikan total durasi ON (menit) per jam untuk setiap lampu pada 8 jam terakhir.
+    Mengembalikan total durasi ON (menit) per jam untuk setiap lampu pada rentang `window` terakhir.
+    Dibaca dari rollup light_usage_hourly, bukan dari log mentah.
     """
-    from db import get_light_logs
-    now = datetime.now(timezone.utc)
-    from_date = now - timedelta(hours=8)
-    # Ambil semua log lampu 8 jam terakhir, limit besar agar tidak terpotong
-    logs_data = get_light_logs(page=1, limit=1000, from_date=from_date)
-    logs = logs_data["logs"]
-    logs.sort(key=lambda x: x["timestamp"])
-
-    # Siapkan struktur data
-    hour_labels = []
-    hour_starts = []
-    for i in range(8):
-        hour_start = (from_date + timedelta(hours=i)).astimezone(JAKARTA_TZ)
-        hour_starts.append(hour_start)
-        hour_labels.append(hour_start.strftime("%H:%M"))
-
-    chart_data = [
-        {"hour": label, "light1": 0, "light2": 0, "light3": 0}
-        for label in hour_labels
-    ]
-
-    for light_id in [1, 2, 3]:
-        # Ambil semua log lampu 8 jam terakhir
-        lamp_logs = [log for log in logs if log.get("light_id") == light_id]
-        # Ambil log terakhir sebelum from_date
-        prev_logs_data = get_light_logs(page=1, limit=1, light_id=light_id, to_date=from_date)
-        prev_logs = prev_logs_data["logs"]
-        prev_status = "off"
-        prev_time = from_date
-        if prev_logs:
-            prev_log = prev_logs[0]
-            prev_status = prev_log["action"]
-            prev_time = prev_log["timestamp"]
-            if isinstance(prev_time, str):
-                prev_time = datetime.fromisoformat(prev_time)
-            if prev_time.tzinfo is None:
-                prev_time = prev_time.replace(tzinfo=timezone.utc)
-        else:
-            prev_status = "off"
-            prev_time = from_date
-
-        # Gabungkan prev_log (jika status "on") dengan lamp_logs
-        events = []
-        if prev_status == "on":
-            # Lampu sudah ON sebelum from_date, tambahkan event ON di from_date
-            events.append({"action": "on", "timestamp": from_date})
-        # Pastikan semua timestamp di lamp_logs bertipe datetime
-        for log in lamp_logs:
-            log_time = log["timestamp"]
-            if isinstance(log_time, str):
-                log_time = datetime.fromisoformat(log_time)
-            if log_time.tzinfo is None:
-                log_time = log_time.replace(tzinfo=timezone.utc)
-            events.append({**log, "timestamp": log_time})
-        # Pastikan semua timestamp di events bertipe datetime
-        for event in events:
-            if isinstance(event["timestamp"], str):
-                event["timestamp"] = datetime.fromisoformat(event["timestamp"])
-            if event["timestamp"].tzinfo is None:
-                event["timestamp"] = event["timestamp"].replace(tzinfo=timezone.utc)
-        events.sort(key=lambda x: x["timestamp"])
-
-        last_status = 0
-        last_time = from_date
-
-        for log in events:
-            log_time = log["timestamp"]
-            if isinstance(log_time, str):
-                log_time = datetime.fromisoformat(log_time)
-            if log_time.tzinfo is None:
-                log_time = log_time.replace(tzinfo=timezone.utc)
-            if last_time.tzinfo is None:
-                last_time = last_time.replace(tzinfo=timezone.utc)
-            if log["action"] == "on":
-                last_status = 1
-                last_time = log_time
-            elif log["action"] == "off" and last_status == 1:
-                start = last_time
-                if start.tzinfo is None:
-                    start = start.replace(tzinfo=timezone.utc)
-                while start < log_time:
-                    hour_idx = int((start - from_date).total_seconds() // 3600)
-                    if 0 <= hour_idx < 8:
-                        hour_start = from_date + timedelta(hours=hour_idx)
-                        hour_end = hour_start + timedelta(hours=1)
-                        segment_end = min(log_time, hour_end)
-                        minutes = int((segment_end - start).total_seconds() // 60)
-                        chart_data[hour_idx][f"light{light_id}"] += minutes
-                        start = segment_end
-                    else:
-                        break
-                last_status = 0
-
-        # Jika lampu masih ON sampai sekarang
-        if last_status == 1:
-            start = last_time
-            end = now
-            while start < end:
-                hour_idx = int((start - from_date).total_seconds() // 3600)
-                if 0 <= hour_idx < 8:
-                    hour_start = from_date + timedelta(hours=hour_idx)
-                    hour_end = hour_start + timedelta(hours=1)
-                    segment_end = min(end, hour_end)
-                    minutes = int((segment_end - start).total_seconds() // 60)
-                    chart_data[hour_idx][f"light{light_id}"] += minutes
-                    start = segment_end
-                else:
-                    break
-
-    return {"data": chart_data}
+    try:
+        delta = parse_window(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": await get_hourly_usage(delta, tz=JAKARTA_TZ)}
+
+ANALYTICS_COLLECTIONS = {"door": "log_door", "light": "log_light", "clothesline": "log_clothesline"}
+
+async def run_analytics(series, from_date, to_date, bucket, tz, *args):
+    """
+    Default rentang 7 hari terakhir. Bucket/timezone tidak valid -> 400.
+    """
+    to_date = to_date or datetime.now(timezone.utc)
+    from_date = from_date or to_date - timedelta(days=7)
+    try:
+        bucket_spec = analytics.parse_bucket(bucket)
+        data = await series(*args, from_date, to_date, bucket_spec, tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"bucket": bucket, "tz": tz, "data": data})
+
+@app.get("/api/analytics/actions")
+async def get_analytics_actions(
+    collection: Literal["door", "light", "clothesline"] = "light",
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    bucket: str = Query("1h", description="Ukuran bucket, mis. 15m, 1h, 1d"),
+    tz: str = "Asia/Jakarta",
+    current_user: dict = Depends(get_current_user)
+):
+    # Jumlah log per action per bucket
+    return await run_analytics(
+        analytics.action_counts, from_date, to_date, bucket, tz, ANALYTICS_COLLECTIONS[collection]
+    )
+
+@app.get("/api/analytics/door-access")
+async def get_analytics_door_access(
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    bucket: str = Query("1h", description="Ukuran bucket, mis. 15m, 1h, 1d"),
+    tz: str = "Asia/Jakarta",
+    current_user: dict = Depends(get_current_user)
+):
+    # Akses pintu per user dan per source (RFID/Web)
+    return await run_analytics(analytics.door_access, from_date, to_date, bucket, tz)
+
+@app.get("/api/analytics/alerts")
+async def get_analytics_alerts(
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    bucket: str = Query("1h", description="Ukuran bucket, mis. 15m, 1h, 1d"),
+    tz: str = "Asia/Jakarta",
+    current_user: dict = Depends(get_current_user)
+):
+    # Percobaan akses tidak dikenal
+    return await run_analytics(analytics.unknown_access_alerts, from_date, to_date, bucket, tz)
+
+@app.get("/api/analytics/clothesline")
+async def get_analytics_clothesline(
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    bucket: str = Query("1h", description="Ukuran bucket, mis. 15m, 1h, 1d"),
+    tz: str = "Asia/Jakarta",
+    current_user: dict = Depends(get_current_user)
+):
+    # Extend/retract dibandingkan dengan trigger sensor hujan
+    return await run_analytics(analytics.clothesline_activity, from_date, to_date, bucket, tz)
 
 class RegisterRequest(BaseModel):
     email: str
@@ -540,26 +770,51 @@ class RegisterRequest(BaseModel):
     name: Optional[str] = None
 
 @app.post("/api/register")
-def register_user_api(req: RegisterRequest = Body(...)):
-    from db import register_user
-    user = register_user(req.email, req.password, req.name)
+async def register_user_api(req: RegisterRequest = Body(...)):
+    # Cek lebih dulu agar email yang sudah terdaftar tidak menghabiskan slot bcrypt
+    if await get_user_by_email(req.email):
+        raise HTTPException(status_code=400, detail="Email sudah terdaftar")
+    try:
+        hashed_password = await hash_password(req.password)
+    except PasswordHasherBusy:
+        raise password_busy_error()
+    user = await register_user(req.email, hashed_password, req.name)
     if user is None:
         raise HTTPException(status_code=400, detail="Email sudah terdaftar")
+    await publish_event("auth_invalidate", {"email": req.email})
     return {"message": "Registrasi berhasil", "user": {"email": user["email"], "name": user.get("name", "")}}
 
-def authenticate_user(email: str, password: str):
+async def authenticate_user(email: str, password: str):
     """
     Autentikasi user berdasarkan email dan password.
     Return user dict jika sukses, None jika gagal.
     """
-    user = get_user_by_email(email)
+    user = await get_user_by_email(email)
     if not user:
         return None
     hashed_password = user.get("hashed_password")
-    if not hashed_password or not pwd_context.verify(password, hashed_password):
+    if not hashed_password:
+        return None
+    verified, new_hash = await verify_password(password, hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        # Work factor berubah (BCRYPT_ROUNDS): simpan hash baru, login tetap berhasil walau gagal
+        try:
+            await update_password_hash(email, new_hash)
+            await publish_event("auth_invalidate", {"email": email})
+            logger.info(f"🔐 Rehashed password for {email}")
+        except Exception as e:
+            logger.error(f"Failed to rehash password for {email}: {e}")
     return user
 
+def password_busy_error():
+    return HTTPException(
+        status_code=503,
+        detail="Server sedang sibuk memproses login, coba lagi sebentar",
+        headers={"Retry-After": "1"},
+    )
+
 def create_access_token(data: dict):
     """
     Membuat JWT access token.
@@ -570,5 +825,13 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def publish(topic: str, message: dict):
-    return mqtt_manager.publish(topic, message)
+async def publish_command(topic: str, message: dict):
+    """
+    Publish perintah ke perangkat dan tunggu konfirmasi broker.
+    """
+    try:
+        return await mqtt_manager.publish_async(topic, message)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Broker MQTT tidak mengkonfirmasi perintah")
+    except PublishError:
+        raise HTTPException(status_code=500, detail="Gagal mengirim perintah ke broker MQTT")
@@ -0,0 +1,290 @@
+"""
+Metrics Prometheus minimal (tanpa dependensi tambahan).
+
+Instrumen di jalur panas hanya menambah angka di memori (satu lock per
+child metric); format teks Prometheus baru dibuat saat /metrics di-scrape.
+Nilai yang sudah dihitung di tempat lain (kedalaman antrean, jumlah client,
+statistik cache) dibaca lewat callback saat scrape, bukan disalin setiap event.
+
+Dengan WEB_CONCURRENCY > 1 setiap worker punya registry sendiri; label `pid`
+pada homytech_process_info menunjukkan worker yang menjawab scrape.
+"""
+import os
+import time
+import asyncio
+import threading
+import functools
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+# Bucket default (detik) dari 0.5 ms sampai 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_str(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class Metric(ABC):
+    """
+    Satu metric dengan label. `labels(*values)` mengembalikan child yang
+    di-cache; metric tanpa label bisa langsung dipakai (inc/observe).
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _new_child(self):
+        """Child baru untuk satu kombinasi label."""
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def __getattr__(self, attr):
+        # Metric tanpa label: teruskan inc/observe/time ke child tunggal
+        if attr in ("inc", "observe", "time") and not self.labelnames:
+            return getattr(self.labels(), attr)
+        raise AttributeError(attr)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in list(self._children.items()):
+            yield from self._samples(key, child)
+
+    def _samples(self, key, child):
+        yield f"{self.name}{_label_str(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self, key, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            labels = _label_str(self.labelnames, key, [("le", _format_value(float(bound)))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{_label_str(self.labelnames, key)} {_format_value(total)}"
+        yield f"{self.name}_count{_label_str(self.labelnames, key)} {count}"
+
+
+class CallbackMetric:
+    """
+    Nilai dibaca dari `fn` saat scrape. `fn` mengembalikan angka (tanpa label)
+    atau dict {tuple label: angka}.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def collect(self):
+        try:
+            values = self.fn()
+        except Exception:
+            # Sumber belum siap (mis. MQTT belum connect): lewati saja
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_label_str(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        return self._register(CallbackMetric(name, documentation, fn, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+registry.callback(
+    "homytech_process_info", "Backend worker process", lambda: {(str(os.getpid()),): 1}, ["pid"]
+)
+
+# --- MQTT ---
+MQTT_MESSAGE_SECONDS = registry.histogram(
+    "homytech_mqtt_message_seconds", "Time to handle one inbound MQTT message", ["topic"]
+)
+MQTT_QUEUE_WAIT_SECONDS = registry.histogram(
+    "homytech_mqtt_queue_wait_seconds", "Time an inbound MQTT message waits in the ingest queue", ["topic"]
+)
+MQTT_MESSAGES = registry.counter(
+    "homytech_mqtt_messages_total", "Inbound MQTT messages by outcome", ["topic", "result"]
+)
+MQTT_PUBLISH_SECONDS = registry.histogram(
+    "homytech_mqtt_publish_seconds", "Time until the broker acknowledges a command publish, by topic pattern", ["topic"]
+)
+MQTT_PUBLISH = registry.counter(
+    "homytech_mqtt_publish_total", "Outbound MQTT publishes by topic pattern and outcome", ["topic", "result"]
+)
+
+# --- MongoDB ---
+DB_OPERATION_SECONDS = registry.histogram(
+    "homytech_db_operation_seconds", "Latency of db.py / db_async.py operations", ["operation"]
+)
+
+# --- WebSocket ---
+WS_BROADCAST_SECONDS = registry.histogram(
+    "homytech_ws_broadcast_seconds", "Time to fan one broadcast out to subscriber queues", ["topic"]
+)
+WS_SERIALIZE_SECONDS = registry.histogram(
+    "homytech_ws_serialize_seconds", "Time to encode one broadcast frame (once per frame and format)", ["format"]
+)
+WS_SEND_SECONDS = registry.histogram(
+    "homytech_ws_send_seconds", "Time to send one frame to one WebSocket client"
+)
+WS_DROPPED = registry.counter(
+    "homytech_ws_dropped_total", "Frames dropped or clients disconnected because a client queue was full", ["policy"]
+)
+WS_SEND_FAILURES = registry.counter(
+    "homytech_ws_send_failures_total", "WebSocket sends that failed or timed out"
+)
+
+# --- Auth ---
+AUTH_SECONDS = registry.histogram(
+    "homytech_auth_seconds", "Cost of authenticating a request", ["stage"]
+)
+PASSWORD_HASH_SECONDS = registry.histogram(
+    "homytech_password_hash_seconds", "Time spent in bcrypt per operation", ["operation"]
+)
+PASSWORD_HASH_QUEUE_SECONDS = registry.histogram(
+    "homytech_password_hash_queue_seconds", "Time a password operation waits for a bcrypt worker", ["operation"]
+)
+PASSWORD_HASH_REJECTED = registry.counter(
+    "homytech_password_hash_rejected_total", "Password operations rejected because the bcrypt executor was full", ["operation"]
+)
+
+def db_operation(func):
+    """
+    Decorator pencatat latensi operasi database ke DB_OPERATION_SECONDS,
+    untuk fungsi sync maupun async. Label `operation` = nama fungsi.
+    """
+    child = DB_OPERATION_SECONDS.labels(func.__name__)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with child.time():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with child.time():
+            return func(*args, **kwargs)
+    return wrapper
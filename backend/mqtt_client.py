@@ -8,18 +8,68 @@ import paho.mqtt.client as mqtt
 import random
 import string
 import asyncio
+import threading
 import datetime
+from collections import deque
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, field_validator
 
-from db import insert_door_log, insert_clothesline_log
-from websocket_manager import (
-    broadcast_door_status,
-    broadcast_clothesline_status,
-    broadcast_alert_status,
-)
+from db import current_utc_time
+from db_async import insert_door_log, insert_clothesline_log, insert_light_log
+from ingest import IngestPipeline
+from device_shadow import device_shadow, shadow_event
+from light_usage import record_light_event_async
+from mqtt_router import TopicRouter
+from event_bus import publish_event, EVENT_BUS_BACKEND
+from metrics import MQTT_PUBLISH, MQTT_PUBLISH_SECONDS
+from tracing import span
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Dengan banyak worker, topic IoT di-subscribe sebagai shared subscription
+# agar setiap pesan hanya diproses (insert DB) oleh satu worker.
+MQTT_SHARED_GROUP = os.environ.get(
+    "MQTT_SHARED_GROUP", "homytech-ingest" if EVENT_BUS_BACKEND == "mqtt" else ""
+)
+# Wildcard: perangkat baru (mis. lampu ke-20) langsung diterima tanpa mengubah daftar ini;
+# topic yang tidak punya route di `router` diabaikan
+INGEST_TOPICS = ["homytech/+/iot", "homytech/light/+/iot"]
+
+# Pola topic perintah keluar; label metrics publish memakai pola ini, bukan topic per perangkat
+command_topics = TopicRouter()
+for pattern in ("homytech/light/{light_id:int}/web", "homytech/door/web",
+                "homytech/clothesline/web", "homytech/clothesline-mode/web"):
+    command_topics.add(pattern, None)
+
+# Publish async: QoS default perintah, batas pesan inflight, dan timeout PUBACK/PUBCOMP
+MQTT_COMMAND_QOS = int(os.environ.get("MQTT_COMMAND_QOS", "1"))
+MQTT_MAX_INFLIGHT = int(os.environ.get("MQTT_MAX_INFLIGHT", "20"))
+MQTT_PUBLISH_TIMEOUT = float(os.environ.get("MQTT_PUBLISH_TIMEOUT", "5.0"))
+
+# Reconnect di background: backoff eksponensial (detik) dengan full jitter
+MQTT_RECONNECT_MIN_DELAY = float(os.environ.get("MQTT_RECONNECT_MIN_DELAY", "0.5"))
+MQTT_RECONNECT_MAX_DELAY = float(os.environ.get("MQTT_RECONNECT_MAX_DELAY", "30"))
+MQTT_KEEPALIVE = int(os.environ.get("MQTT_KEEPALIVE", "60"))
+# Perintah yang dikirim saat broker terputus ditahan di antrean sampai terhubung lagi
+MQTT_OUTBOX_SIZE = int(os.environ.get("MQTT_OUTBOX_SIZE", "100"))
+MQTT_OUTBOX_WAIT = float(os.environ.get("MQTT_OUTBOX_WAIT", "10.0"))
+
+def reconnect_delay(attempt: int) -> float:
+    """
+    Jeda acak antara MQTT_RECONNECT_MIN_DELAY dan min(max, min * 2^attempt),
+    agar worker yang restart bersamaan tidak menyerbu broker di detik yang sama.
+    """
+    ceiling = min(MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_MIN_DELAY * (2 ** min(attempt, 16)))
+    return random.uniform(MQTT_RECONNECT_MIN_DELAY, max(ceiling, MQTT_RECONNECT_MIN_DELAY))
+
+
+class PublishError(Exception):
+    def __init__(self, topic, rc):
+        super().__init__(f"Failed to publish to {topic}, error code: {rc}")
+        self.topic = topic
+        self.rc = rc
+
 
 class MQTTClientManager:
     def __init__(self, loop):
@@ -27,7 +77,35 @@ class MQTTClientManager:
         self.client = mqtt.Client(client_id=self._generate_client_id())
 
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        self.client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        # Semua tulis socket dilakukan thread supervisor (client.loop); tanpa callback ini
+        # paho menulis langsung dari thread pemanggil publish() karena loop_start tidak dipakai
+        self.client.on_socket_register_write = lambda client, userdata, sock: None
+
+        # mid -> future yang selesai saat PUBACK/PUBCOMP diterima; hanya diakses dari event loop
+        self._pending = {}
+        self._inflight = asyncio.Semaphore(MQTT_MAX_INFLIGHT)
+
+        # (topic, future) per perintah yang menunggu koneksi, urut FIFO
+        self._outbox = deque()
+        self._stopping = threading.Event()
+        self._supervisor = None
+        self._connected = False
+        self._connected_once = False
+        self.connect_attempts = 0
+        self.reconnects = 0
+        self.last_error = None
+
+        self.pipeline = IngestPipeline(
+            loop,
+            router.dispatch,
+            workers=int(os.environ.get("MQTT_INGEST_WORKERS", "4")),
+            queue_size=int(os.environ.get("MQTT_INGEST_QUEUE_SIZE", "1000")),
+            label=router.label,
+        )
 
         self._setup_auth()
 
@@ -41,100 +119,284 @@ class MQTTClientManager:
             self.client.username_pw_set(mqtt_user, mqtt_pass)
         self.client.clean_session = True
 
-    def connect(self, max_retries=30, delay=2):
+    def connect(self):
+        """
+        Mulai thread supervisor koneksi MQTT lalu langsung kembali, sehingga
+        startup tidak menunggu broker. Koneksi, reconnect, dan subscribe ulang
+        ditangani di thread tersebut.
+        """
+        if self._supervisor is not None:
+            return
+        self._stopping.clear()
+        self._supervisor = threading.Thread(target=self._supervise, name="mqtt-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
         broker_host = os.environ.get("MQTT_HOST", "localhost")
         broker_port = int(os.environ.get("MQTT_PORT", "1883"))
 
-        attempts = 0
-        while attempts < max_retries:
+        while not self._stopping.is_set():
             try:
-                self.client.connect(broker_host, broker_port)
-                self.client.loop_start()
-                logger.info(f"🚀 MQTT client loop started on {broker_host}:{broker_port}")
-                return
+                self.client.connect(broker_host, broker_port, keepalive=MQTT_KEEPALIVE)
             except Exception as e:
-                attempts += 1
-                logger.warning(f"⏳ MQTT connect attempt {attempts}/{max_retries} failed: {e}")
-                time.sleep(delay)
+                self._backoff(f"connect to {broker_host}:{broker_port} failed: {e}")
+                continue
+
+            logger.info(f"🚀 MQTT network loop started on {broker_host}:{broker_port}")
+            rc = mqtt.MQTT_ERR_SUCCESS
+            # stop() memanggil disconnect(), sehingga loop berhenti setelah DISCONNECT terkirim
+            while rc == mqtt.MQTT_ERR_SUCCESS:
+                rc = self.client.loop(timeout=1.0)
+            self._connected = False
+            if self._stopping.is_set():
+                break
+            self._backoff(f"connection lost: {mqtt.error_string(rc)}")
+
+        logger.info("MQTT supervisor stopped")
 
-        logger.error("❌ Maximum retry attempts reached. MQTT connection failed.")
-        raise ConnectionError("Unable to connect to MQTT broker after multiple attempts.")
+    def _backoff(self, reason: str):
+        self.last_error = reason
+        delay = reconnect_delay(self.connect_attempts)
+        self.connect_attempts += 1
+        logger.warning(f"⏳ MQTT {reason}; retry #{self.connect_attempts} in {delay:.1f}s")
+        self._stopping.wait(delay)
 
     def stop(self):
-        self.client.loop_stop()
+        self._stopping.set()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        if self._supervisor is not None:
+            self._supervisor.join(timeout=5)
+            self._supervisor = None
+        while self._outbox:
+            topic, waiter = self._outbox.popleft()
+            if not waiter.done():
+                waiter.set_exception(PublishError(topic, mqtt.MQTT_ERR_NO_CONN))
+
+    def is_connected(self) -> bool:
+        # client.is_connected() milik paho 1.x tetap True setelah koneksi putus
+        return self._connected
+
+    def connection_status(self) -> dict:
+        return {
+            "ok": self.is_connected(),
+            "reconnects": self.reconnects,
+            "queued_commands": len(self._outbox),
+            **({"last_error": self.last_error} if not self.is_connected() and self.last_error else {}),
+        }
 
-    def publish(self, topic, message):
+    async def publish_async(self, topic, message, qos=MQTT_COMMAND_QOS, timeout=MQTT_PUBLISH_TIMEOUT):
+        """
+        Publish lalu tunggu konfirmasi broker (PUBACK untuk QoS 1, PUBCOMP untuk QoS 2).
+        QoS 0 selesai begitu pesan diserahkan ke client paho.
+        Raise PublishError jika paho menolak pesan, asyncio.TimeoutError jika
+        konfirmasi tidak datang dalam `timeout` detik.
+        """
         if isinstance(message, dict):
             message = json.dumps(message)
-        result = self.client.publish(topic, message)
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"📤 Sent '{message}' to topic '{topic}'")
-        else:
-            logger.warning(f"⚠️ Failed to send message to topic {topic}, error code: {result.rc}")
-        return result
+        label = command_topics.label(topic)
+        with span("mqtt.publish", topic=topic, qos=qos):
+            if not self.is_connected():
+                await self._wait_for_connection(topic)
+            async with self._inflight:
+                future = self.loop.create_future()
+                started = time.perf_counter()
+                result = self.client.publish(topic, message, qos=qos)
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    MQTT_PUBLISH.labels(label, "error").inc()
+                    logger.warning(f"⚠️ Failed to send message to topic {topic}, error code: {result.rc}")
+                    raise PublishError(topic, result.rc)
+                if qos == 0:
+                    MQTT_PUBLISH.labels(label, "sent").inc()
+                    return result
+                # Didaftarkan sebelum await: _acked dijadwalkan ke event loop ini,
+                # jadi tidak bisa berjalan sebelum mid ada di _pending
+                self._pending[result.mid] = future
+                try:
+                    await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    MQTT_PUBLISH.labels(label, "timeout").inc()
+                    logger.warning(f"⚠️ No acknowledgement for message on {topic} after {timeout}s")
+                    raise
+                finally:
+                    self._pending.pop(result.mid, None)
+                MQTT_PUBLISH.labels(label, "acked").inc()
+                MQTT_PUBLISH_SECONDS.labels(label).observe(time.perf_counter() - started)
+                logger.info(f"📤 Delivered '{message}' to topic '{topic}'")
+                return result
+
+    async def publish_many(self, messages, qos=MQTT_COMMAND_QOS, timeout=MQTT_PUBLISH_TIMEOUT):
+        """
+        Publish banyak pesan sekaligus lalu tunggu semua konfirmasinya bersamaan.
+        `messages` berisi pasangan (topic, message). Return list hasil per pesan,
+        berisi exception untuk pesan yang gagal.
+        """
+        return await asyncio.gather(
+            *(self.publish_async(topic, message, qos, timeout) for topic, message in messages),
+            return_exceptions=True,
+        )
+
+    async def _wait_for_connection(self, topic):
+        """
+        Tahan perintah di antrean outbound sampai broker terhubung kembali
+        (maksimal MQTT_OUTBOX_WAIT detik). Perintah dilepas sesuai urutan masuk.
+        """
+        label = command_topics.label(topic)
+        if len(self._outbox) >= MQTT_OUTBOX_SIZE:
+            MQTT_PUBLISH.labels(label, "rejected").inc()
+            logger.warning(f"⚠️ Outbound queue full, rejecting message to {topic}")
+            raise PublishError(topic, mqtt.MQTT_ERR_QUEUE_SIZE)
+
+        entry = (topic, self.loop.create_future())
+        self._outbox.append(entry)
+        logger.info(f"📥 MQTT disconnected, queued message to {topic} ({len(self._outbox)} waiting)")
+        try:
+            await asyncio.wait_for(entry[1], MQTT_OUTBOX_WAIT)
+        except asyncio.TimeoutError:
+            MQTT_PUBLISH.labels(label, "timeout").inc()
+            logger.warning(f"⚠️ MQTT still disconnected after {MQTT_OUTBOX_WAIT}s, dropping message to {topic}")
+            raise
+        finally:
+            if entry in self._outbox:
+                self._outbox.remove(entry)
+
+    def _release_outbox(self):
+        # Dipanggil di event loop setelah koneksi pulih
+        while self._outbox and self.is_connected():
+            _, waiter = self._outbox.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _on_publish(self, client, userdata, mid):
+        # Dipanggil thread supervisor sambil memegang mutex paho; tidak boleh mengambil
+        # lock yang juga dipegang pemanggil client.publish(), jadi serahkan ke event loop
+        self.loop.call_soon_threadsafe(self._acked, mid)
+
+    def _acked(self, mid):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
 
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
+            if self._connected_once:
+                self.reconnects += 1
+            self._connected = self._connected_once = True
+            self.connect_attempts = 0
+            self.last_error = None
             logger.info("✅ Connected to MQTT broker successfully.")
-            client.subscribe("homytech/door/iot")
-            client.subscribe("homytech/clothesline/iot")
-            client.subscribe("homytech/alert/iot")
+            # clean_session=True: subscription hilang setiap koneksi baru, jadi selalu subscribe ulang
+            prefix = f"$share/{MQTT_SHARED_GROUP}/" if MQTT_SHARED_GROUP else ""
+            client.subscribe([(prefix + topic, 0) for topic in INGEST_TOPICS])
             logger.info("📡 Subscribed to MQTT topics.")
+            self.loop.call_soon_threadsafe(self._release_outbox)
         else:
+            self.last_error = mqtt.connack_string(rc)
             logger.error(f"❌ Failed to connect, return code {rc}")
 
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected = False
+        if rc != 0:
+            logger.warning(f"⚠️ Disconnected from MQTT broker unexpectedly, return code {rc}")
+
     def _on_message(self, client, userdata, msg):
-        topic = msg.topic
-        try:
-            payload = json.loads(msg.payload.decode())
-            logger.info(f"📥 Received message on {topic}: {payload}")
-
-            now = datetime.datetime.now().isoformat()
-
-            if topic == "homytech/door/iot":
-                insert_door_log(
-                    user=payload.get("user", "-"),
-                    action=payload.get("action", "-"),
-                    source="RFID"
-                )
-                asyncio.run_coroutine_threadsafe(
-                    broadcast_door_status({
-                        "user": payload.get("user", "-"),
-                        "action": payload.get("action", "-"),
-                        "timestamp": now,
-                        "source": "RFID"
-                    }),
-                    self.loop
-                )
-
-            elif topic == "homytech/clothesline/iot":
-                insert_clothesline_log(
-                    user="System",
-                    action=payload.get("action", "-"),
-                    source="Rain Sensor"
-                )
-                asyncio.run_coroutine_threadsafe(
-                    broadcast_clothesline_status({
-                        "user": "System",
-                        "action": payload.get("action", "-"),
-                        "timestamp": now,
-                        "source": "Rain Sensor"
-                    }),
-                    self.loop
-                )
-
-            elif topic == "homytech/alert/iot":
-                insert_door_log(
-                    user="Unknown",
-                    action=f"Tried to {payload.get('action', 'access')} door",
-                    source="Alert System"
-                )
-                asyncio.run_coroutine_threadsafe(
-                    broadcast_alert_status({
-                        "action": payload.get("action"),
-                        "timestamp": now
-                    }),
-                    self.loop
-                )
-        except Exception as e:
-            logger.error(f"❌ Failed to process message on {topic}: {e}")
+        # Hanya enqueue; decode, simpan, dan broadcast dilakukan oleh IngestPipeline
+        self.pipeline.submit(msg.topic, msg.payload)
+
+
+# --- Routing pesan perangkat ---
+class DevicePayload(BaseModel):
+    # Firmware bisa mengirim ID kartu RFID sebagai angka
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+# Field yang tidak dikirim perangkat diisi default seperti sebelumnya ("-")
+class DoorPayload(DevicePayload):
+    user: str = "-"
+    action: str = "-"
+
+
+class ClotheslinePayload(DevicePayload):
+    action: str = "-"
+
+
+class AlertPayload(DevicePayload):
+    action: Optional[str] = None
+
+
+class LightPayload(DevicePayload):
+    action: str
+    user: str = "Device"
+
+    @field_validator("action")
+    @classmethod
+    def _normalize_action(cls, value: str) -> str:
+        value = value.lower()
+        if value not in ("on", "off"):
+            raise ValueError("action harus on atau off")
+        return value
+
+
+router = TopicRouter()
+
+@router.route("homytech/door/iot", DoorPayload)
+async def handle_door(payload: DoorPayload):
+    logger.info(f"📥 Door message: {payload}")
+    now = datetime.datetime.now().isoformat()
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("door", timestamp, user=payload.user, action=payload.action, source="RFID"))
+    await insert_door_log(user=payload.user, action=payload.action, source="RFID", timestamp=timestamp)
+    await publish_event("door", {
+        "user": payload.user,
+        "action": payload.action,
+        "timestamp": now,
+        "source": "RFID"
+    })
+
+@router.route("homytech/clothesline/iot", ClotheslinePayload)
+async def handle_clothesline(payload: ClotheslinePayload):
+    logger.info(f"📥 Clothesline message: {payload}")
+    now = datetime.datetime.now().isoformat()
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("clothesline", timestamp, user="System", action=payload.action, source="Rain Sensor"))
+    await insert_clothesline_log(user="System", action=payload.action, source="Rain Sensor", timestamp=timestamp)
+    await publish_event("clothesline", {
+        "user": "System",
+        "action": payload.action,
+        "timestamp": now,
+        "source": "Rain Sensor"
+    })
+
+@router.route("homytech/alert/iot", AlertPayload)
+async def handle_alert(payload: AlertPayload):
+    logger.info(f"📥 Alert message: {payload}")
+    now = datetime.datetime.now().isoformat()
+    await insert_door_log(
+        user="Unknown",
+        action=f"Tried to {payload.action or 'access'} door",
+        source="Alert System"
+    )
+    await publish_event("alert", {
+        "action": payload.action,
+        "timestamp": now
+    })
+
+@router.route("homytech/light/{light_id:int}/iot", LightPayload)
+async def handle_light(payload: LightPayload, light_id: int):
+    # Feedback yang hanya mengkonfirmasi perintah dari web (status sama) tidak dicatat ulang
+    if device_shadow.get_light(light_id).get("action") == payload.action:
+        return
+    logger.info(f"📥 Light {light_id} feedback: {payload}")
+    now = datetime.datetime.now().isoformat()
+    timestamp = current_utc_time()
+    await publish_event("shadow", shadow_event("light", timestamp, light_id=light_id, action=payload.action, user=payload.user))
+    await insert_light_log(light_id, payload.action, payload.user, timestamp)
+    await record_light_event_async(light_id, payload.action, timestamp)
+    await publish_event("light", {
+        "user": payload.user,
+        "light_id": light_id,
+        "action": payload.action,
+        "timestamp": now,
+    })
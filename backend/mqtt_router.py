@@ -0,0 +1,154 @@
+"""
+Routing pesan MQTT masuk ke handler berdasarkan pola topic.
+
+Pola ditulis per segmen, dengan parameter `{nama}` atau `{nama:int}`:
+
+    router = TopicRouter()
+
+    @router.route("homytech/light/{light_id:int}/iot", LightPayload)
+    async def handle_light(payload: LightPayload, light_id: int): ...
+
+Pola disimpan dalam trie per segmen (segmen literal didahulukan dari
+parameter), dan hasil pencocokan setiap topic konkret di-cache, sehingga
+pesan berikutnya dari perangkat yang sama cukup satu lookup dict tanpa
+mencocokkan ulang semua pola. Payload divalidasi dengan model pydantic milik
+route sebelum handler dipanggil.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_CONVERTERS = {"str": str, "int": int}
+# Batas jumlah topic konkret yang hasil pencocokannya disimpan
+MATCH_CACHE_SIZE = 4096
+
+
+class Route:
+    __slots__ = ("pattern", "handler", "model", "params", "filter")
+
+    def __init__(self, pattern: str, handler, model=None):
+        self.pattern = pattern
+        self.handler = handler
+        self.model = model
+        # (index segmen, nama, converter) untuk setiap parameter
+        self.params = []
+        segments = []
+        for index, segment in enumerate(pattern.split("/")):
+            if segment.startswith("{") and segment.endswith("}"):
+                name, _, kind = segment[1:-1].partition(":")
+                if kind and kind not in _CONVERTERS:
+                    raise ValueError(f"Unknown parameter type {kind!r} in {pattern}")
+                self.params.append((index, name, _CONVERTERS[kind or "str"]))
+                segments.append("+")
+            elif segment in ("+", "#"):
+                raise ValueError(f"Use {{name}} instead of MQTT wildcards in route {pattern}")
+            else:
+                segments.append(segment)
+        # Filter MQTT yang setara, mis. homytech/light/+/iot; dipakai juga sebagai label metrics
+        self.filter = "/".join(segments)
+
+    def convert(self, segments):
+        """
+        Return: dict parameter hasil konversi, atau None jika ada yang tidak valid (mis. bukan int).
+        """
+        params = {}
+        for index, name, converter in self.params:
+            try:
+                params[name] = converter(segments[index])
+            except ValueError:
+                return None
+        return params
+
+
+class _Node:
+    __slots__ = ("literals", "param", "routes")
+
+    def __init__(self):
+        self.literals = {}
+        self.param = None
+        self.routes = []
+
+
+class TopicRouter:
+    def __init__(self, cache_size: int = MATCH_CACHE_SIZE):
+        self._root = _Node()
+        self._cache = {}
+        self.cache_size = cache_size
+        self.routes = []
+
+    def add(self, pattern: str, handler, model=None) -> Route:
+        route = Route(pattern, handler, model)
+        node = self._root
+        for segment in route.filter.split("/"):
+            if segment == "+":
+                node.param = node.param or _Node()
+                node = node.param
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        node.routes.append(route)
+        self.routes.append(route)
+        self._cache.clear()
+        return route
+
+    def route(self, pattern: str, model=None):
+        """
+        Decorator untuk mendaftarkan handler async `handler(payload, **params)`.
+        """
+        def decorator(handler):
+            self.add(pattern, handler, model)
+            return handler
+        return decorator
+
+    def _walk(self, node, segments, depth):
+        if depth == len(segments):
+            for route in node.routes:
+                params = route.convert(segments)
+                if params is not None:
+                    return route, params
+            return None
+        child = node.literals.get(segments[depth])
+        if child is not None:
+            found = self._walk(child, segments, depth + 1)
+            if found is not None:
+                return found
+        if node.param is not None:
+            return self._walk(node.param, segments, depth + 1)
+        return None
+
+    def match(self, topic: str):
+        """
+        Return: (Route, params) untuk topic, atau None jika tidak ada route yang cocok.
+        """
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        found = self._walk(self._root, topic.split("/"), 0)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = found
+        return found
+
+    def label(self, topic: str) -> str:
+        # Label metrics per pola route, bukan per perangkat, agar kardinalitasnya tetap kecil
+        found = self.match(topic)
+        return found[0].filter if found else "unrouted"
+
+    async def dispatch(self, topic: str, raw: bytes) -> bool:
+        """
+        Validasi payload lalu panggil handler route yang cocok.
+        Return False jika tidak ada route untuk topic. Raise ValueError
+        (termasuk pydantic ValidationError) jika payload tidak valid.
+        """
+        found = self.match(topic)
+        if found is None:
+            logger.debug(f"No route for MQTT topic {topic}")
+            return False
+        route, params = found
+        if route.model is not None:
+            payload = route.model.model_validate_json(raw)
+        else:
+            payload = json.loads(raw)
+        await route.handler(payload, **params)
+        return True
@@ -0,0 +1,110 @@
+"""
+Hash dan verifikasi password bcrypt di executor khusus yang ukurannya dibatasi.
+
+bcrypt sengaja mahal (±100 ms per operasi pada BCRYPT_ROUNDS=12), jadi
+pekerjaan ini tidak boleh memakai threadpool Starlette yang juga melayani
+query database, dan tidak boleh menumpuk tanpa batas saat banyak perangkat
+login bersamaan (mis. setelah listrik padam). PASSWORD_HASH_WORKERS thread
+menjalankan bcrypt (C extension, GIL dilepas); paling banyak
+PASSWORD_HASH_QUEUE_SIZE permintaan lain boleh menunggu, selebihnya langsung
+ditolak dengan PasswordHasherBusy (HTTP 503) agar klien mencoba lagi nanti.
+
+Hash yang dibuat dengan work factor berbeda dari BCRYPT_ROUNDS diganti
+otomatis saat login berhasil (lihat `verify_password`).
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from metrics import registry, PASSWORD_HASH_SECONDS, PASSWORD_HASH_QUEUE_SECONDS, PASSWORD_HASH_REJECTED
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    """Executor penuh: jumlah operasi yang berjalan + menunggu sudah mencapai batas."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.limit = workers + queue_size
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def _get_executor(self):
+        # Dibuat saat pertama dipakai, yaitu di proses worker (setelah fork gunicorn)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, operation: str, func, *args):
+        with self._lock:
+            if self.pending >= self.limit:
+                PASSWORD_HASH_REJECTED.labels(operation).inc()
+                raise PasswordHasherBusy(f"{self.pending} password operations pending")
+            self.pending += 1
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            PASSWORD_HASH_QUEUE_SECONDS.labels(operation).observe(started - submitted)
+            with PASSWORD_HASH_SECONDS.labels(operation).time():
+                return func(*args)
+
+        try:
+            future = self._get_executor().submit(timed)
+        except Exception:
+            self._release()
+            raise
+        # Slot dilepas saat bcrypt selesai, bukan saat pemanggil berhenti menunggu
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
+
+registry.callback(
+    "homytech_password_hash_pending", "Password hash/verify operations running or queued",
+    lambda: password_hasher.pending,
+)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run("hash", pwd_context.hash, password)
+
+async def verify_password(password: str, hashed_password: str):
+    """
+    Verifikasi password. Return (cocok, hash_baru); hash_baru berisi hash
+    dengan BCRYPT_ROUNDS saat ini jika hash lama perlu diganti, selain itu None.
+    Raise PasswordHasherBusy jika executor penuh.
+    """
+    try:
+        return await password_hasher.run("verify", pwd_context.verify_and_update, password, hashed_password)
+    except ValueError as e:
+        # Hash tersimpan rusak / format tidak dikenal: anggap password salah
+        logger.warning(f"Unable to verify password hash: {e}")
+        return False, None
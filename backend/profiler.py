@@ -0,0 +1,58 @@
+"""
+Profiler statistik on-demand untuk worker yang sedang berjalan.
+
+Sebuah thread mengambil stack semua thread (sys._current_frames) setiap
+`interval` detik selama `duration` detik, lalu hasilnya digabung dalam
+format "collapsed stack" (frame;frame;frame jumlah) yang bisa langsung
+diberikan ke flamegraph.pl / speedscope. Tidak ada overhead sama sekali
+saat profiler tidak dijalankan.
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "false").lower() == "true"
+MAX_PROFILE_SECONDS = 60.0
+
+_running = threading.Lock()
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def sample_stacks(duration: float, interval: float = 0.005) -> dict:
+    """
+    Mengambil sampel stack semua thread (kecuali thread profiler sendiri).
+    Return: {"samples": n, "stacks": Counter({"thread;frame;...": jumlah})}.
+    Raise RuntimeError jika profiler lain masih berjalan.
+    """
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("Profiler is already running")
+    try:
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + min(duration, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stacks[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+            samples += 1
+            time.sleep(interval)
+        return {"samples": samples, "stacks": stacks}
+    finally:
+        _running.release()
+
+def render_collapsed(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
@@ -0,0 +1,289 @@
+"""
+Retensi log perangkat: data panas di MongoDB, data lama di arsip.
+
+Log yang lebih tua dari RETENTION_HOT_DAYS diproses per hari (UTC):
+
+1. ditulis ke arsip NDJSON gzip ARCHIVE_DIR/<koleksi>/YYYY/MM/DD.ndjson.gz,
+2. diringkas ke koleksi `log_daily_summary` (jumlah per action/user/perangkat),
+3. baru kemudian dihapus dari MongoDB.
+
+Log terakhir setiap perangkat tidak pernah dihapus agar status terakhir
+(device shadow) tetap bisa dimuat. Setiap langkah idempoten, jadi job yang
+terputus cukup dijalankan ulang. Hanya satu worker yang menjalankan job
+dalam satu waktu (lease di koleksi `locks`).
+
+Dijalankan periodik dari lifespan jika RETENTION_ENABLED=true, atau manual:
+
+    python retention.py run
+"""
+import os
+import sys
+import gzip
+import socket
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from bson import json_util
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import db
+import db_async
+from db import LOG_COLLECTIONS, LOG_META_FIELDS, LOG_SORT, LATEST_DOOR_FILTER, LOG_STORAGE_MODE, current_utc_time
+from timeseries import supports_timeseries_deletes
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+RETENTION_ENABLED = os.environ.get("RETENTION_ENABLED", "false").lower() == "true"
+RETENTION_HOT_DAYS = int(os.environ.get("RETENTION_HOT_DAYS", "30"))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", str(6 * 3600)))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+SUMMARY_COLLECTION = "log_daily_summary"
+LOCKS_COLLECTION = "locks"
+LEASE_NAME = "retention"
+LEASE_TTL = timedelta(minutes=30)
+DELETE_BATCH_SIZE = 1000
+
+_ONE_DAY = timedelta(days=1)
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _as_utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def _day_start(dt):
+    dt = _as_utc(dt)
+    return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+
+# --- Lease: hanya satu worker yang menjalankan retensi ---
+def acquire_lease(owner: str, ttl: timedelta = LEASE_TTL) -> bool:
+    """
+    Mengambil atau memperpanjang lease. Return False jika lease masih dipegang worker lain.
+    """
+    now = current_utc_time()
+    try:
+        db.get_collection(LOCKS_COLLECTION).find_one_and_update(
+            {"_id": LEASE_NAME, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + ttl}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return True
+    except DuplicateKeyError:
+        # Dokumen lease ada dan dipegang worker lain, upsert bentrok di _id
+        return False
+
+def release_lease(owner: str):
+    db.get_collection(LOCKS_COLLECTION).delete_one({"_id": LEASE_NAME, "owner": owner})
+
+# --- Arsip NDJSON gzip per hari ---
+def archive_path(collection_name: str, day: datetime) -> str:
+    return os.path.join(ARCHIVE_DIR, collection_name, f"{day:%Y}", f"{day:%m}", f"{day:%d}.ndjson.gz")
+
+def read_archive_file(path: str) -> list:
+    """
+    Membaca satu file arsip. Return list dokumen log (timestamp naive UTC seperti dari MongoDB).
+    """
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json_util.loads(line) for line in f if line.strip()]
+
+def write_archive_file(path: str, logs: list):
+    # Tulis ke file sementara lalu rename agar arsip tidak pernah setengah jadi
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for log in logs:
+            f.write(json_util.dumps(log, json_options=json_util.RELAXED_JSON_OPTIONS))
+            f.write("\n")
+    os.replace(tmp_path, path)
+
+def archive_days(collection_name: str, from_date=None, to_date=None) -> list:
+    """
+    Path file arsip yang mencakup rentang [from_date, to_date], urut tanggal.
+    """
+    root = os.path.join(ARCHIVE_DIR, collection_name)
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(".ndjson.gz"):
+                continue
+            path = os.path.join(dirpath, filename)
+            year, month = os.path.relpath(dirpath, root).split(os.sep)[-2:]
+            day = datetime(int(year), int(month), int(filename[:2]), tzinfo=timezone.utc)
+            if from_date and day + _ONE_DAY <= _as_utc(from_date):
+                continue
+            if to_date and day > _as_utc(to_date):
+                continue
+            paths.append((day, path))
+    return [path for _, path in sorted(paths)]
+
+def _matches(log: dict, query: dict) -> bool:
+    # Cukup untuk bentuk filter dari db._build_log_query (kesetaraan + rentang timestamp)
+    for field, value in query.items():
+        if field == "timestamp":
+            timestamp = _as_utc(log["timestamp"])
+            if "$gte" in value and timestamp < _as_utc(value["$gte"]):
+                return False
+            if "$lte" in value and timestamp > _as_utc(value["$lte"]):
+                return False
+        elif log.get(field) != value:
+            return False
+    return True
+
+async def iter_archived_logs(collection_name: str, query: dict):
+    """
+    Iterasi log terarsip yang cocok dengan `query`, urut (timestamp, _id) naik.
+    File dibaca satu per satu di thread pool agar event loop tidak terblokir.
+    """
+    timestamp = query.get("timestamp", {})
+    paths = await asyncio.to_thread(archive_days, collection_name, timestamp.get("$gte"), timestamp.get("$lte"))
+    for path in paths:
+        for log in await asyncio.to_thread(read_archive_file, path):
+            if _matches(log, query):
+                yield log
+
+# --- Ringkasan harian ---
+def _summarize(collection_name: str, day: datetime, logs: list) -> dict:
+    meta = LOG_META_FIELDS[collection_name]
+    counts = {}
+    for log in logs:
+        key = (log.get("action"), log.get("user"), log.get(meta))
+        counts[key] = counts.get(key, 0) + 1
+    return {
+        "collection": collection_name,
+        "day": day,
+        "total": len(logs),
+        "counts": [
+            {"action": action, "user": user, meta: value, "count": count}
+            for (action, user, value), count in sorted(counts.items(), key=lambda item: str(item[0]))
+        ],
+        "updated_at": current_utc_time(),
+    }
+
+async def get_daily_summaries(collection_name: str, from_date=None, to_date=None) -> list:
+    query = {"collection": collection_name}
+    if from_date or to_date:
+        query["day"] = {}
+        if from_date:
+            query["day"]["$gte"] = _day_start(from_date)
+        if to_date:
+            query["day"]["$lte"] = _as_utc(to_date)
+    cursor = db_async.get_collection(SUMMARY_COLLECTION).find(query, {"_id": 0, "updated_at": 0}).sort("day", 1)
+    summaries = await cursor.to_list()
+    for summary in summaries:
+        summary["day"] = f"{summary['day']:%Y-%m-%d}"
+    return summaries
+
+# --- Job retensi ---
+def _keep_ids(collection_name: str) -> set:
+    """
+    _id log terakhir per perangkat (metaField), ditambah log yang dipakai
+    get_latest_*_state. Log ini tidak ikut dihapus.
+    """
+    collection = db.get_collection(collection_name)
+    meta = LOG_META_FIELDS[collection_name]
+    pipeline = [
+        {"$sort": {meta: 1, "timestamp": -1}},
+        {"$group": {"_id": f"${meta}", "log_id": {"$first": "$_id"}}},
+    ]
+    keep = {row["log_id"] for row in collection.aggregate(pipeline)}
+    latest = collection.find_one(
+        LATEST_DOOR_FILTER if collection_name == "log_door" else {}, {"_id": 1}, sort=LOG_SORT
+    )
+    if latest:
+        keep.add(latest["_id"])
+    return keep
+
+def compact_day(collection_name: str, day: datetime, keep: set) -> int:
+    """
+    Arsip + ringkas + hapus log satu hari. Return jumlah log yang dihapus.
+    """
+    collection = db.get_collection(collection_name)
+    logs = list(
+        collection.find({"timestamp": {"$gte": day, "$lt": day + _ONE_DAY}}).sort([("timestamp", 1), ("_id", 1)])
+    )
+    path = archive_path(collection_name, day)
+    archived = read_archive_file(path)
+    archived_ids = {log["_id"] for log in archived}
+    to_archive = [log for log in logs if log["_id"] not in keep and log["_id"] not in archived_ids]
+    if to_archive:
+        archived = sorted(archived + to_archive, key=lambda log: (_as_utc(log["timestamp"]), log["_id"]))
+        write_archive_file(path, archived)
+        archived_ids.update(log["_id"] for log in to_archive)
+
+    # Ringkasan dihitung ulang dari arsip + log yang masih disimpan, jadi aman dijalankan ulang
+    kept = [log for log in logs if log["_id"] not in archived_ids]
+    db.get_collection(SUMMARY_COLLECTION).replace_one(
+        {"_id": f"{collection_name}:{day:%Y-%m-%d}"},
+        _summarize(collection_name, day, archived + kept),
+        upsert=True,
+    )
+
+    # Hapus hanya setelah arsip tertulis
+    delete_ids = [log["_id"] for log in logs if log["_id"] in archived_ids]
+    for i in range(0, len(delete_ids), DELETE_BATCH_SIZE):
+        collection.delete_many({"_id": {"$in": delete_ids[i:i + DELETE_BATCH_SIZE]}})
+    return len(delete_ids)
+
+def compact_collection(collection_name: str, cutoff: datetime, owner: str) -> int:
+    collection = db.get_collection(collection_name)
+    keep = _keep_ids(collection_name)
+    removed = 0
+    while True:
+        oldest = collection.find_one(
+            {"timestamp": {"$lt": cutoff}, "_id": {"$nin": list(keep)}},
+            {"timestamp": 1},
+            sort=[("timestamp", 1)],
+        )
+        if not oldest:
+            return removed
+        if not acquire_lease(owner):
+            logger.warning("Retention lease lost, stopping")
+            return removed
+        day = _day_start(oldest["timestamp"])
+        count = compact_day(collection_name, day, keep)
+        removed += count
+        logger.info(f"🗄️ Archived {count} logs from {collection_name} for {day:%Y-%m-%d}")
+
+def run_retention(hot_days: int = RETENTION_HOT_DAYS) -> dict:
+    """
+    Menjalankan satu putaran retensi untuk semua koleksi log.
+    Return: {koleksi: jumlah log yang dihapus}, atau {} jika worker lain sedang menjalankannya.
+    """
+    if LOG_STORAGE_MODE == "timeseries" and not supports_timeseries_deletes(db.get_database()):
+        logger.error("❌ Retention skipped: deleting from time-series collections needs MongoDB 7.0+")
+        return {}
+    owner = _owner()
+    if not acquire_lease(owner):
+        logger.info("Retention already running on another worker")
+        return {}
+    try:
+        cutoff = _day_start(current_utc_time() - timedelta(days=hot_days))
+        return {name: compact_collection(name, cutoff, owner) for name in LOG_COLLECTIONS}
+    finally:
+        release_lease(owner)
+
+async def retention_loop(interval: float = RETENTION_INTERVAL):
+    # Dijalankan sebagai task dari lifespan; pekerjaan berat di thread pool
+    while True:
+        try:
+            removed = await asyncio.to_thread(run_retention)
+            if removed:
+                logger.info(f"Retention finished: {removed}")
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+        await asyncio.sleep(interval)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["run"]:
+        print(run_retention())
+    else:
+        print("Usage: python retention.py run")
+        sys.exit(1)
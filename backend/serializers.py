@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timezone, timedelta
+from starlette.responses import Response
+
+from tracing import span
+
+try:
+    import orjson
+except ImportError:  # fallback ke json standar jika orjson tidak terpasang
+    orjson = None
+
+JAKARTA_TZ = timezone(timedelta(hours=7))
+
+# Field setiap koleksi log beserta tipenya. Dipakai untuk projection query
+# dan konversi satu kali jalan tanpa menebak tipe dari isi string.
+LOG_SCHEMAS = {
+    "log_door": {"user": "str", "action": "str", "source": "str", "timestamp": "datetime"},
+    "log_light": {"user": "str", "light_id": "int", "action": "str", "timestamp": "datetime"},
+    "log_clothesline": {"user": "str", "action": "str", "source": "str", "timestamp": "datetime"},
+}
+
+# _id ikut secara default; di response hanya muncul sebagai "id"
+LOG_PROJECTIONS = {
+    name: {field: 1 for field in schema}
+    for name, schema in LOG_SCHEMAS.items()
+}
+
+_DATETIME_FIELDS = {
+    name: tuple(field for field, kind in schema.items() if kind == "datetime")
+    for name, schema in LOG_SCHEMAS.items()
+}
+
+def to_jakarta_iso(dt: datetime) -> str:
+    # Timestamp dari MongoDB naive tetapi selalu UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(JAKARTA_TZ).isoformat()
+
+def serialize_log(collection_name: str, log: dict) -> dict:
+    """
+    Mengubah dokumen log (hasil LOG_PROJECTIONS) menjadi dict siap-JSON:
+    `_id` menjadi `id` dan field datetime menjadi ISO waktu Jakarta.
+    """
+    out = {"id": str(log["_id"])} if "_id" in log else {}
+    for key, value in log.items():
+        if key != "_id":
+            out[key] = value
+    for field in _DATETIME_FIELDS[collection_name]:
+        value = out.get(field)
+        if isinstance(value, datetime):
+            out[field] = to_jakarta_iso(value)
+    return out
+
+def serialize_state(state: dict, datetime_fields=("timestamp",)) -> dict:
+    """
+    Versi serialize_log untuk entri device shadow (tanpa _id).
+    """
+    out = dict(state)
+    for field in datetime_fields:
+        value = out.get(field)
+        if isinstance(value, datetime):
+            out[field] = to_jakarta_iso(value)
+    return out
+
+def encode_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), default=str).encode()
+
+
+class FastJSONResponse(Response):
+    """
+    JSONResponse yang langsung meng-encode ke bytes dengan orjson.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        with span("render"):
+            return encode_json(content)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modul backend berada satu level di atas (layout flat, tanpa package)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
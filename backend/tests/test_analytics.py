@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import analytics
+from analytics import parse_bucket, parse_timezone, floor_bucket, next_bucket, ceil_bucket, settled_until
+
+UTC = timezone.utc
+JAKARTA = ZoneInfo("Asia/Jakarta")
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=UTC)
+
+
+@pytest.mark.parametrize("text, unit, size, delta", [
+    ("15m", "minute", 15, timedelta(minutes=15)),
+    ("1h", "hour", 1, timedelta(hours=1)),
+    ("6h", "hour", 6, timedelta(hours=6)),
+    ("1d", "day", 1, timedelta(days=1)),
+])
+def test_parse_bucket(text, unit, size, delta):
+    assert parse_bucket(text) == (unit, size, delta)
+
+
+@pytest.mark.parametrize("text", ["", "0h", "1w", "h", "1.5h", "-1h"])
+def test_parse_bucket_invalid(text):
+    with pytest.raises(ValueError):
+        parse_bucket(text)
+
+
+def test_parse_timezone_invalid():
+    with pytest.raises(ValueError):
+        parse_timezone("Mars/Olympus")
+
+
+def test_floor_bucket_utc():
+    assert floor_bucket(utc(2025, 3, 4, 10, 37, 12), parse_bucket("15m"), UTC) == utc(2025, 3, 4, 10, 30)
+    assert floor_bucket(utc(2025, 3, 4, 10, 30), parse_bucket("15m"), UTC) == utc(2025, 3, 4, 10, 30)
+
+
+def test_floor_bucket_uses_local_day_boundary():
+    # 2025-03-04 20:00 UTC = 2025-03-05 03:00 WIB; hari lokal mulai 2025-03-04 17:00 UTC
+    assert floor_bucket(utc(2025, 3, 4, 20), parse_bucket("1d"), JAKARTA) == utc(2025, 3, 4, 17)
+
+
+def test_floor_bucket_bin_size_aligned_to_2000_01_01():
+    # Sama seperti $dateTrunc: bin 6 jam dihitung dari 2000-01-01 00:00 lokal
+    bucket = parse_bucket("6h")
+    assert floor_bucket(utc(2025, 3, 4, 13, 59), bucket, UTC) == utc(2025, 3, 4, 12)
+    # 7 hari sejak 2000-01-01 (Sabtu), jadi bucket mingguan mulai hari Sabtu
+    start = floor_bucket(utc(2025, 3, 4, 12), parse_bucket("7d"), UTC)
+    assert start == utc(2025, 3, 1)
+    assert start.weekday() == 5
+
+
+def test_next_bucket_steps_local_wall_clock_across_dst():
+    bucket = parse_bucket("1d")
+    # Berlin pindah ke CEST pada 2025-03-30: hari itu hanya 23 jam
+    day = floor_bucket(utc(2025, 3, 30, 12), bucket, BERLIN)
+    assert day == utc(2025, 3, 29, 23)
+    assert next_bucket(day, bucket, BERLIN) == utc(2025, 3, 30, 22)
+    assert next_bucket(day, bucket, BERLIN) - day == timedelta(hours=23)
+
+
+def test_buckets_are_contiguous():
+    bucket = parse_bucket("1h")
+    current = floor_bucket(utc(2025, 3, 29, 20), bucket, BERLIN)
+    for _ in range(12):
+        following = next_bucket(current, bucket, BERLIN)
+        assert floor_bucket(following, bucket, BERLIN) == following
+        assert floor_bucket(following - timedelta(seconds=1), bucket, BERLIN) == current
+        current = following
+
+
+def test_ceil_bucket():
+    bucket = parse_bucket("1h")
+    assert ceil_bucket(utc(2025, 3, 4, 10), bucket, UTC) == utc(2025, 3, 4, 10)
+    assert ceil_bucket(utc(2025, 3, 4, 10, 0, 1), bucket, UTC) == utc(2025, 3, 4, 11)
+
+
+def test_settled_until_leaves_recently_closed_bucket_uncached(monkeypatch):
+    monkeypatch.setattr(analytics, "LOG_FLUSH_INTERVAL", 1.0)
+    monkeypatch.setattr(analytics, "ANALYTICS_SETTLE_SECONDS", 10.0)
+    bucket = parse_bucket("1h")
+    # Bucket 10:00-11:00 baru berakhir 5 detik lalu: log terlambat masih bisa masuk
+    assert settled_until(utc(2025, 3, 4, 11, 0, 5), bucket, UTC) == utc(2025, 3, 4, 10)
+    assert settled_until(utc(2025, 3, 4, 11, 0, 11), bucket, UTC) == utc(2025, 3, 4, 11)
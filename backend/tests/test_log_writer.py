@@ -0,0 +1,74 @@
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from log_writer import BatchLogWriter, DUPLICATE_KEY_ERROR
+
+
+class FakeCollection:
+    """insert_many yang menjalankan `outcomes` berurutan: None (sukses) atau fungsi yang raise."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def insert_many(self, docs, ordered=True):
+        self.calls.append([doc["_id"] for doc in docs])
+        outcome = self.outcomes.pop(0)
+        if outcome is not None:
+            outcome(docs)
+
+
+def bulk_error(codes_by_index):
+    def raise_error(docs):
+        raise BulkWriteError({
+            "writeErrors": [{"index": index, "code": code} for index, code in codes_by_index.items()],
+            "nInserted": len(docs) - len(codes_by_index),
+        })
+    return raise_error
+
+
+def make_writer(collection, max_retries=3):
+    writer = BatchLogWriter(lambda name: collection, ["log"], max_retries=max_retries)
+    writer._stopping.set()  # tanpa jeda antar percobaan
+    return writer
+
+
+def docs(count):
+    return [{"_id": i} for i in range(count)]
+
+
+def test_flush_success():
+    collection = FakeCollection([None])
+    writer = make_writer(collection)
+    writer._flush("log", docs(3))
+    assert writer.stats["log"] == {"written": 3, "dropped": 0, "failed": 0, "batches": 1}
+
+
+def test_partial_failure_retries_only_failed_docs():
+    collection = FakeCollection([bulk_error({1: 121}), None])
+    writer = make_writer(collection)
+    writer._flush("log", docs(3))
+    assert collection.calls == [[0, 1, 2], [1]]
+    assert writer.stats["log"]["written"] == 3
+    assert writer.stats["log"]["failed"] == 0
+
+
+def test_duplicate_keys_count_as_written():
+    # Error jaringan setelah server menyimpan batch: percobaan ulang hanya menemukan duplicate key
+    def network_error(docs):
+        raise AutoReconnect("connection reset")
+
+    collection = FakeCollection([network_error, bulk_error({0: DUPLICATE_KEY_ERROR, 1: DUPLICATE_KEY_ERROR})])
+    writer = make_writer(collection)
+    writer._flush("log", docs(2))
+    assert len(collection.calls) == 2
+    assert writer.stats["log"]["written"] == 2
+    assert writer.stats["log"]["failed"] == 0
+
+
+def test_failed_after_retries_counts_only_unwritten():
+    collection = FakeCollection([bulk_error({0: 121, 2: 121}), bulk_error({0: 121})])
+    writer = make_writer(collection, max_retries=2)
+    writer._flush("log", docs(3))
+    assert collection.calls == [[0, 1, 2], [0, 2]]
+    assert writer.stats["log"]["written"] == 2
+    assert writer.stats["log"]["failed"] == 1
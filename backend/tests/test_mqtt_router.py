@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from mqtt_router import TopicRouter
+
+
+async def handler(payload, **params):
+    return None
+
+
+def make_router(*patterns):
+    router = TopicRouter()
+    for pattern in patterns:
+        router.add(pattern, handler)
+    return router
+
+
+def matched(router, topic):
+    found = router.match(topic)
+    return None if found is None else (found[0].pattern, found[1])
+
+
+def test_param_converted_to_int():
+    router = make_router("homytech/light/{light_id:int}/iot")
+    assert matched(router, "homytech/light/12/iot") == ("homytech/light/{light_id:int}/iot", {"light_id": 12})
+
+
+def test_int_conversion_failure_is_no_match():
+    router = make_router("homytech/light/{light_id:int}/iot")
+    assert router.match("homytech/light/kitchen/iot") is None
+
+
+def test_str_param_is_default():
+    router = make_router("homytech/{device}/iot")
+    assert matched(router, "homytech/door/iot") == ("homytech/{device}/iot", {"device": "door"})
+
+
+def test_literal_wins_over_param():
+    router = make_router("homytech/{device}/iot", "homytech/door/iot")
+    assert matched(router, "homytech/door/iot") == ("homytech/door/iot", {})
+    assert matched(router, "homytech/alert/iot") == ("homytech/{device}/iot", {"device": "alert"})
+
+
+def test_falls_back_to_param_when_literal_branch_fails():
+    router = make_router("homytech/light/{light_id:int}/iot", "homytech/{device}/{name}/iot")
+    assert matched(router, "homytech/light/x/iot") == ("homytech/{device}/{name}/iot", {"device": "light", "name": "x"})
+
+
+@pytest.mark.parametrize("topic", [
+    "homytech/door",
+    "homytech/door/iot/extra",
+    "other/door/iot",
+    "",
+])
+def test_segment_count_and_literals_must_match(topic):
+    router = make_router("homytech/door/iot", "homytech/{device}/iot")
+    assert router.match(topic) is None
+
+
+def test_filter_uses_mqtt_single_level_wildcard():
+    router = make_router("homytech/light/{light_id:int}/iot", "homytech/door/iot")
+    assert [route.filter for route in router.routes] == ["homytech/light/+/iot", "homytech/door/iot"]
+
+
+def test_label_is_route_filter_or_unrouted():
+    router = make_router("homytech/light/{light_id:int}/web")
+    assert router.label("homytech/light/3/web") == "homytech/light/+/web"
+    assert router.label("homytech/light/3/iot") == "unrouted"
+
+
+@pytest.mark.parametrize("pattern", [
+    "homytech/+/iot",
+    "homytech/#",
+    "homytech/{light_id:float}/iot",
+])
+def test_invalid_pattern_rejected(pattern):
+    with pytest.raises(ValueError):
+        TopicRouter().add(pattern, handler)
+
+
+def test_match_cached_and_cleared_on_add():
+    router = make_router("homytech/{device}/iot")
+    first = router.match("homytech/door/iot")
+    assert router.match("homytech/door/iot") is first
+    router.add("homytech/door/iot", handler)
+    assert matched(router, "homytech/door/iot") == ("homytech/door/iot", {})
+
+
+def test_cache_bounded():
+    router = TopicRouter(cache_size=2)
+    router.add("homytech/light/{light_id:int}/iot", handler)
+    for light_id in range(5):
+        router.match(f"homytech/light/{light_id}/iot")
+    assert len(router._cache) <= 2
+
+
+class LightPayload(BaseModel):
+    action: str
+
+
+def test_dispatch_validates_payload_and_passes_params():
+    router = TopicRouter()
+    calls = []
+
+    @router.route("homytech/light/{light_id:int}/iot", LightPayload)
+    async def handle_light(payload: LightPayload, light_id: int):
+        calls.append((payload.action, light_id))
+
+    assert asyncio.run(router.dispatch("homytech/light/2/iot", b'{"action": "on"}')) is True
+    assert calls == [("on", 2)]
+
+
+def test_dispatch_without_model_parses_json():
+    router = TopicRouter()
+    calls = []
+
+    @router.route("homytech/alert/iot")
+    async def handle_alert(payload):
+        calls.append(payload)
+
+    asyncio.run(router.dispatch("homytech/alert/iot", b'{"level": 1}'))
+    assert calls == [{"level": 1}]
+
+
+def test_dispatch_unrouted_returns_false():
+    router = make_router("homytech/door/iot")
+    assert asyncio.run(router.dispatch("homytech/window/iot", b"{}")) is False
+
+
+def test_dispatch_invalid_payload_raises():
+    router = TopicRouter()
+    router.add("homytech/light/{light_id:int}/iot", handler, LightPayload)
+    with pytest.raises(ValidationError):
+        asyncio.run(router.dispatch("homytech/light/2/iot", b'{"state": "on"}'))
@@ -0,0 +1,128 @@
+import json
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from db import LOG_SORT, encode_cursor, decode_cursor, _page_spec, _build_page
+
+BASE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_logs(count):
+    # Urut terbaru dulu, seperti hasil find() dengan LOG_SORT
+    return [{"_id": ObjectId(), "timestamp": BASE - timedelta(minutes=i)} for i in range(count)]
+
+
+@pytest.mark.parametrize("direction", ["next", "prev"])
+def test_cursor_round_trip(direction):
+    log = make_logs(1)[0]
+    timestamp, log_id, decoded_direction = decode_cursor(encode_cursor(log, direction))
+    assert (timestamp, log_id, decoded_direction) == (log["timestamp"], log["_id"], direction)
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not-base64!",
+    "W10",  # []
+    encode_cursor(make_logs(1)[0], "next")[:-4],
+])
+def test_decode_invalid_cursor(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_decode_rejects_unknown_direction():
+    token = encode_cursor(make_logs(1)[0], "next")
+    raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    raw[2] = "sideways"
+    bad = base64.urlsafe_b64encode(json.dumps(raw).encode()).decode().rstrip("=")
+    with pytest.raises(ValueError):
+        decode_cursor(bad)
+
+
+def test_page_spec_without_cursor_uses_skip():
+    query, sort, skip, direction = _page_spec({"user": "a"}, page=3, limit=10)
+    assert query == {"user": "a"}
+    assert sort == LOG_SORT
+    assert skip == 20
+    assert direction is None
+
+
+def test_page_spec_next_and_prev_keyset():
+    log = make_logs(1)[0]
+    query, sort, skip, direction = _page_spec({}, 1, 10, encode_cursor(log, "next"))
+    assert skip == 0 and direction == "next"
+    assert sort == [("timestamp", -1), ("_id", -1)]
+    assert query == {"$or": [
+        {"timestamp": {"$lt": log["timestamp"]}},
+        {"timestamp": log["timestamp"], "_id": {"$lt": log["_id"]}},
+    ]}
+
+    query, sort, _, direction = _page_spec({"user": "a"}, 1, 10, encode_cursor(log, "prev"))
+    assert direction == "prev"
+    assert sort == [("timestamp", 1), ("_id", 1)]
+    assert query["$and"][0] == {"user": "a"}
+    assert query["$and"][1]["$or"][0] == {"timestamp": {"$gt": log["timestamp"]}}
+
+
+def test_first_page_has_only_next_cursor():
+    logs = make_logs(11)
+    page = _build_page(list(logs), limit=10, page=1)
+    assert page["logs"] == logs[:10]
+    assert page["prev_cursor"] is None
+    assert decode_cursor(page["next_cursor"])[1] == logs[9]["_id"]
+
+
+def test_last_page_has_only_prev_cursor():
+    logs = make_logs(4)
+    page = _build_page(list(logs), limit=10, page=1, direction="next")
+    assert page["next_cursor"] is None
+    assert decode_cursor(page["prev_cursor"])[1] == logs[0]["_id"]
+
+
+def test_single_page_has_no_cursors():
+    page = _build_page(make_logs(3), limit=10, page=1)
+    assert page["next_cursor"] is None and page["prev_cursor"] is None
+
+
+def test_empty_page():
+    assert _build_page([], limit=10, page=1, direction="next") == {
+        "logs": [], "next_cursor": None, "prev_cursor": None,
+    }
+
+
+def test_prev_page_is_returned_newest_first():
+    # Query "prev" diurutkan naik; hasilnya dibalik agar tetap terbaru dulu
+    logs = make_logs(6)
+    ascending = list(reversed(logs[:6]))
+    page = _build_page(ascending, limit=5, page=1, direction="prev")
+    assert page["logs"] == logs[1:6]
+    assert page["next_cursor"] is not None
+    assert page["prev_cursor"] is not None
+
+
+def test_next_then_prev_returns_to_same_page():
+    logs = make_logs(25)
+
+    def fetch(cursor, limit=10):
+        # Simulasi find() di atas list terurut memakai spec dari _page_spec
+        _, sort, _, direction = _page_spec({}, 1, limit, cursor)
+        timestamp, log_id, _ = decode_cursor(cursor)
+        key = (timestamp, log_id)
+        if direction == "next":
+            rows = [log for log in logs if (log["timestamp"], log["_id"]) < key]
+        else:
+            rows = sorted((log for log in logs if (log["timestamp"], log["_id"]) > key),
+                          key=lambda log: (log["timestamp"], log["_id"]))
+        return _build_page(rows[:limit + 1], limit, 1, direction)
+
+    first = _build_page(logs[:11], 10, 1)
+    second = fetch(first["next_cursor"])
+    assert second["logs"] == logs[10:20]
+    back = fetch(second["prev_cursor"])
+    assert back["logs"] == first["logs"]
+    # Kembali ke halaman terbaru: tidak ada halaman yang lebih baru lagi
+    assert back["prev_cursor"] is None
+    assert back["next_cursor"] is not None
@@ -0,0 +1,173 @@
+"""
+Mode penyimpanan time-series untuk log perangkat.
+
+Dengan LOG_STORAGE_MODE=timeseries, log_door / log_light / log_clothesline
+disimpan di koleksi time-series MongoDB (log_door_ts, ...) dengan
+timeField "timestamp" dan metaField identitas perangkat (LOG_META_FIELDS).
+Koleksi time-series harus dibuat eksplisit sebelum insert pertama, jadi
+`ensure_timeseries_collections` dipanggil saat startup.
+
+Migrasi data lama dari koleksi biasa (bisa dijalankan ulang, melanjutkan
+dari watermark _id terakhir yang tersimpan di koleksi `migrations`):
+
+    python timeseries.py migrate [batch_size]
+    python timeseries.py status
+
+Urutan yang disarankan: jalankan migrate, ganti LOG_STORAGE_MODE ke
+timeseries dan restart backend, lalu jalankan migrate sekali lagi untuk
+menyalin log yang masuk di antara keduanya.
+
+Koleksi time-series butuh MongoDB 5.0+. Menghapus dokumen dengan filter di
+luar metaField (melanjutkan migrasi yang terputus, retensi) butuh MongoDB 7.0+.
+"""
+import os
+import sys
+import logging
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+import db
+from db import LOG_COLLECTIONS, LOG_META_FIELDS, physical_collection_name, current_utc_time
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+MIGRATIONS_COLLECTION = "migrations"
+TIMESERIES_GRANULARITY = os.environ.get("LOG_TS_GRANULARITY", "seconds")
+MIGRATION_BATCH_SIZE = 5000
+# Versi minimal untuk delete_many dengan filter _id/timestamp di koleksi time-series
+TIMESERIES_DELETE_MIN_VERSION = (7, 0)
+
+def server_version(database) -> tuple:
+    return tuple(database.client.server_info()["versionArray"][:2])
+
+def supports_timeseries_deletes(database) -> bool:
+    return server_version(database) >= TIMESERIES_DELETE_MIN_VERSION
+
+def timeseries_options(collection_name: str) -> dict:
+    return {
+        "timeField": "timestamp",
+        "metaField": LOG_META_FIELDS[collection_name],
+        "granularity": TIMESERIES_GRANULARITY,
+    }
+
+def ensure_timeseries_collections():
+    """
+    Membuat koleksi time-series yang belum ada. Idempoten dan aman dipanggil
+    beberapa worker sekaligus. Return: list koleksi yang baru dibuat.
+    """
+    database = db.get_database()
+    existing = {info["name"]: info.get("type") for info in database.list_collections()}
+    created = []
+    for name in LOG_COLLECTIONS:
+        target = physical_collection_name(name, "timeseries")
+        if target in existing:
+            if existing[target] != "timeseries":
+                logger.error(f"{target} exists but is not a time-series collection")
+            continue
+        try:
+            database.create_collection(target, timeseries=timeseries_options(name))
+            created.append(target)
+        except (CollectionInvalid, OperationFailure) as e:
+            # Biasanya sudah dibuat worker lain di saat yang sama
+            logger.info(f"Skipped creating {target}: {e}")
+    if created:
+        logger.info(f"Created time-series collections: {created}")
+    return created
+
+def migrate_collection(collection_name: str, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """
+    Menyalin satu koleksi log biasa ke koleksi time-series-nya, urut _id per batch.
+    Progres disimpan setelah setiap batch sehingga migrasi yang terputus bisa
+    dilanjutkan. Return: jumlah dokumen yang disalin pada pemanggilan ini.
+    """
+    database = db.get_database()
+    migrations = database[MIGRATIONS_COLLECTION]
+    state_id = f"timeseries:{collection_name}"
+    source = database[collection_name]
+    target = database[physical_collection_name(collection_name, "timeseries")]
+
+    state = migrations.find_one({"_id": state_id}) or {}
+    last_id = state.get("last_id")
+    total = state.get("copied", 0)
+
+    pending = state.get("pending_until")
+    if pending is not None and not supports_timeseries_deletes(database):
+        version = ".".join(map(str, server_version(database)))
+        raise RuntimeError(
+            f"Cannot resume the interrupted migration of {collection_name}: removing the partially "
+            f"copied batch from {target.name} needs MongoDB 7.0+, server is {version}. Before switching "
+            f"LOG_STORAGE_MODE, drop {target.name} and delete the '{state_id}' document from "
+            f"'{MIGRATIONS_COLLECTION}', then run migrate again."
+        )
+    if pending is not None:
+        # Batch terakhir mungkin sudah sebagian masuk sebelum proses berhenti;
+        # time-series tidak punya unique index _id, jadi hapus dulu agar tidak dobel
+        id_range = {"$lte": pending}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        removed = target.delete_many({"_id": id_range}).deleted_count
+        logger.info(f"Removed {removed} partially copied logs from {target.name}")
+
+    copied = 0
+    while True:
+        # timeField wajib bertipe date di koleksi time-series
+        query = {"timestamp": {"$type": "date"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(source.find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        until = batch[-1]["_id"]
+        migrations.update_one({"_id": state_id}, {"$set": {"pending_until": until}}, upsert=True)
+        target.insert_many(batch, ordered=False)
+        copied += len(batch)
+        migrations.update_one({"_id": state_id}, {
+            "$set": {"last_id": until, "copied": total + copied, "updated_at": current_utc_time()},
+            "$unset": {"pending_until": ""},
+        })
+        last_id = until
+        logger.info(f"Copied {total + copied} logs from {collection_name} to {target.name}")
+
+    migrations.update_one(
+        {"_id": state_id}, {"$set": {"completed_at": current_utc_time()}}, upsert=True
+    )
+    return copied
+
+def migrate(batch_size: int = MIGRATION_BATCH_SIZE):
+    if not supports_timeseries_deletes(db.get_database()):
+        logger.warning("⚠️ MongoDB < 7.0: an interrupted migration cannot be resumed automatically")
+    ensure_timeseries_collections()
+    for name in LOG_COLLECTIONS:
+        copied = migrate_collection(name, batch_size)
+        logger.info(f"✅ {name}: {copied} logs copied")
+
+def status():
+    """
+    Return: dict per koleksi berisi jumlah dokumen sumber/target dan state migrasi.
+    """
+    database = db.get_database()
+    migrations = database[MIGRATIONS_COLLECTION]
+    result = {}
+    for name in LOG_COLLECTIONS:
+        target = physical_collection_name(name, "timeseries")
+        state = migrations.find_one({"_id": f"timeseries:{name}"}) or {}
+        result[name] = {
+            "source_count": database[name].estimated_document_count(),
+            "target": target,
+            "target_count": database[target].count_documents({}),
+            "copied": state.get("copied", 0),
+            "last_id": str(state["last_id"]) if state.get("last_id") else None,
+            "completed_at": state.get("completed_at"),
+        }
+    return result
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == "migrate" and len(args) <= 2:
+        migrate(int(args[1]) if len(args) == 2 else MIGRATION_BATCH_SIZE)
+    elif args == ["status"]:
+        for name, info in status().items():
+            print(f"{name}: {info}")
+    else:
+        print("Usage: python timeseries.py migrate [batch_size] | status")
+        sys.exit(1)
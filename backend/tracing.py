@@ -0,0 +1,195 @@
+"""
+Tracing per-request (sampled) dan slow-query log.
+
+TRACE_SAMPLE_RATE (0.0 - 1.0, default 0) menentukan porsi request HTTP yang
+direkam; request dengan header `X-Trace: 1` selalu direkam. Setiap tahap yang
+dibungkus `span(...)` (decode JWT, lookup user, query log, serialisasi,
+publish MQTT) menjadi satu span dengan durasi dan atribut. Trace selesai
+ditulis ke logger "trace" sebagai satu baris JSON dan disimpan di
+`recent_traces` untuk /api/debug/traces.
+
+Saat request tidak di-sample, `span()` hanya membaca satu contextvar lalu
+mengembalikan context manager no-op yang sama.
+
+Slow-query log selalu aktif: operasi MongoDB yang lebih lama dari
+SLOW_QUERY_MS dicatat bersama filter, sort, dan durasinya.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import logging
+from collections import deque
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("trace")
+slow_query_logger = logging.getLogger("slow_query")
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+RECENT_TRACES = int(os.environ.get("TRACE_BUFFER_SIZE", "100"))
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+recent_traces = deque(maxlen=RECENT_TRACES)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "parent", "started", "duration", "_token")
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.duration = None
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _current_span.reset(self._token)
+        self.trace.spans.append(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class Trace:
+    def __init__(self, method: str, path: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def to_dict(self, status: int, duration: float):
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "spans": [span.to_dict() for span in sorted(self.spans, key=lambda s: s.started)],
+        }
+
+def span(name: str, **attrs):
+    """
+    Context manager span di dalam trace aktif; no-op jika request tidak di-sample.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(trace, name, attrs)
+
+def _jsonable(value):
+    # Filter MongoDB bisa berisi datetime/ObjectId; cukup untuk log
+    return json.dumps(value, default=str)
+
+class QuerySpan:
+    """
+    Span + slow-query log untuk satu operasi MongoDB.
+    """
+    __slots__ = ("operation", "collection", "filter", "sort", "span", "started")
+
+    def __init__(self, operation: str, collection: str, filter=None, sort=None):
+        self.operation = operation
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort
+
+    def __enter__(self):
+        self.span = span(f"mongo.{self.operation}", collection=self.collection)
+        self.span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        self.span.__exit__(*exc)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            slow_query_logger.warning(
+                f"🐢 Slow {self.operation} on {self.collection}: {elapsed_ms:.1f} ms "
+                f"filter={_jsonable(self.filter)} sort={self.sort}"
+            )
+        return False
+
+
+def query_span(operation: str, collection: str, filter=None, sort=None) -> QuerySpan:
+    return QuerySpan(operation, collection, filter, sort)
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI: memulai trace untuk request HTTP yang di-sample dan
+    menambahkan header X-Trace-Id pada response-nya.
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._sampled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        status = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_trace.reset(token)
+            record = trace.to_dict(status, time.perf_counter() - trace.started)
+            recent_traces.append(record)
+            trace_logger.info(_jsonable(record))
+
+    def _sampled(self, scope) -> bool:
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        return any(name == b"x-trace" and value == b"1" for name, value in scope["headers"])
@@ -1,90 +1,243 @@
 from fastapi import WebSocket
-from typing import List
+from typing import Dict, Optional, Set
+import os
+import json
+import time
+import zlib
+import asyncio
 import logging
 
+from serializers import encode_json
+from metrics import registry, WS_BROADCAST_SECONDS, WS_SERIALIZE_SECONDS, WS_SEND_SECONDS, WS_DROPPED, WS_SEND_FAILURES
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-connected_clients_light: List[WebSocket] = []
-connected_clients_door: List[WebSocket] = []
-connected_clients_clothesline: List[WebSocket] = []
-connected_clients_alert: List[WebSocket] = []
+# Setiap koneksi punya antrean keluar sendiri dan satu task pengirim, sehingga
+# satu browser yang lambat tidak menahan broadcast ke client lain.
+SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "2.0"))
+QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "64"))
+# drop_oldest: buang pesan terlama (client tetap menerima status terbaru)
+# drop_newest: buang pesan baru selama antrean penuh
+# disconnect : putuskan client yang antreannya penuh
+SLOW_CLIENT_POLICY = os.environ.get("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+
+TOPICS = ("light", "door", "clothesline", "alert")
+
+# Level zlib untuk client yang meminta frame terkompresi (?compress=true)
+COMPRESSION_LEVEL = int(os.environ.get("WS_COMPRESSION_LEVEL", "6"))
+
+class BroadcastFrame:
+    """
+    Payload broadcast yang di-encode satu kali dan dipakai bersama oleh semua
+    subscriber. Ada dua bentuk: `raw` (data apa adanya, untuk endpoint lama
+    /ws/<topic>) dan `envelope` ({"topic", "data"} untuk /ws multiplexed),
+    masing-masing bisa dikompres zlib. Tiap bentuk di-encode saat pertama
+    dibutuhkan lalu di-cache.
+    """
+    __slots__ = ("topic", "data", "_encoded")
+
+    def __init__(self, topic: str, data: dict):
+        self.topic = topic
+        self.data = data
+        self._encoded = {}
+
+    def encode(self, envelope: bool = False, compress: bool = False):
+        key = (envelope, compress)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if compress:
+                text = self.encode(envelope)
+                with WS_SERIALIZE_SECONDS.labels("zlib").time():
+                    encoded = zlib.compress(text.encode(), COMPRESSION_LEVEL)
+            else:
+                with WS_SERIALIZE_SECONDS.labels("envelope" if envelope else "raw").time():
+                    payload = {"topic": self.topic, "data": self.data} if envelope else self.data
+                    encoded = encode_json(payload).decode()
+            self._encoded[key] = encoded
+        return encoded
+
+
+class ControlFrame(BroadcastFrame):
+    # Pesan kontrol (ack/error) untuk satu client, selalu dikirim apa adanya
+    def __init__(self, data: dict):
+        super().__init__(None, data)
+
+    def encode(self, envelope: bool = False, compress: bool = False):
+        return super().encode(False, compress)
+
+
+class ClientConnection:
+    """
+    Satu koneksi WebSocket dengan antrean keluar dan task pengirimnya sendiri.
+    `subscriptions` memetakan topic -> filter perangkat (mis. {"light_id": 1})
+    atau None untuk semua pesan pada topic tersebut.
+    """
+
+    def __init__(self, websocket: WebSocket, multiplexed: bool = False):
+        self.websocket = websocket
+        self.multiplexed = multiplexed
+        self.compress = websocket.query_params.get("compress", "").lower() == "true"
+        self.subscriptions: Dict[str, Optional[dict]] = {}
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._sender())
+
+    def matches(self, topic: str, data: dict) -> bool:
+        filters = self.subscriptions.get(topic)
+        return not filters or all(data.get(key) == value for key, value in filters.items())
+
+    def offer(self, frame: BroadcastFrame):
+        """
+        Memasukkan pesan ke antrean tanpa menunggu; kebijakan SLOW_CLIENT_POLICY
+        berlaku saat antrean penuh.
+        """
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+            return
+        WS_DROPPED.labels(SLOW_CLIENT_POLICY).inc()
+        if SLOW_CLIENT_POLICY == "disconnect":
+            logger.warning(f"Disconnecting slow client {self.websocket.client}")
+            self.close()
+        elif SLOW_CLIENT_POLICY == "drop_oldest":
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+
+    async def _sender(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                # Encode (biasanya sudah di-cache oleh subscriber lain) diukur terpisah
+                # di WS_SERIALIZE_SECONDS; WS_SEND_SECONDS hanya waktu kirim ke socket
+                payload = frame.encode(self.multiplexed, self.compress)
+                started = time.perf_counter()
+                if self.compress:
+                    send = self.websocket.send_bytes(payload)
+                else:
+                    send = self.websocket.send_text(payload)
+                await asyncio.wait_for(send, SEND_TIMEOUT)
+                WS_SEND_SECONDS.observe(time.perf_counter() - started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                WS_SEND_FAILURES.inc()
+                logger.info(f"Dropping client {self.websocket.client}: {e!r}")
+                self.close()
+                return
+
+    def close(self):
+        disconnect_client(self.websocket)
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(), SEND_TIMEOUT)
+        except Exception:
+            pass
+
+
+# Index topic -> subscriber dan websocket -> koneksi
+_subscribers: Dict[str, Set[ClientConnection]] = {topic: set() for topic in TOPICS}
+_connections: Dict[WebSocket, ClientConnection] = {}
+
+registry.callback(
+    "homytech_ws_subscribers", "WebSocket clients subscribed per topic",
+    lambda: {(topic,): len(connections) for topic, connections in _subscribers.items()}, ["topic"],
+)
+registry.callback("homytech_ws_connections", "Open WebSocket connections", lambda: len(_connections))
 
 # === Fungsi koneksi/disconnect ===
-async def connect_client_light(websocket: WebSocket):
+async def connect_client(websocket: WebSocket, multiplexed: bool = False) -> ClientConnection:
     await websocket.accept()
-    connected_clients_light.append(websocket)
+    connection = ClientConnection(websocket, multiplexed)
+    _connections[websocket] = connection
+    connection.start()
+    return connection
+
+def disconnect_client(websocket: WebSocket):
+    connection = _connections.pop(websocket, None)
+    if connection is None:
+        return
+    for topic in connection.subscriptions:
+        _subscribers[topic].discard(connection)
+    connection.subscriptions.clear()
+    if connection.task and connection.task is not asyncio.current_task():
+        connection.task.cancel()
+
+def subscribe(connection: ClientConnection, topic: str, filters: Optional[dict] = None):
+    if topic not in _subscribers:
+        raise ValueError(f"Unknown topic: {topic}")
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("filter harus berupa object")
+    connection.subscriptions[topic] = filters or None
+    _subscribers[topic].add(connection)
+
+def unsubscribe(connection: ClientConnection, topic: str):
+    connection.subscriptions.pop(topic, None)
+    if topic in _subscribers:
+        _subscribers[topic].discard(connection)
+
+def handle_client_message(connection: ClientConnection, message: str):
+    """
+    Memproses pesan dari client /ws:
+        {"op": "subscribe", "topic": "light", "filter": {"light_id": 1}}
+        {"op": "unsubscribe", "topic": "light"}
+    Balasan {"op": "subscribed"/"unsubscribed"/"error", ...} dikirim lewat antrean koneksi.
+    """
+    try:
+        request = json.loads(message)
+        op, topic = request.get("op"), request.get("topic")
+        if op == "subscribe":
+            subscribe(connection, topic, request.get("filter"))
+            reply = {"op": "subscribed", "topic": topic, "filter": connection.subscriptions[topic]}
+        elif op == "unsubscribe":
+            unsubscribe(connection, topic)
+            reply = {"op": "unsubscribed", "topic": topic}
+        else:
+            raise ValueError(f"Unknown op: {op}")
+    except (ValueError, AttributeError) as e:
+        reply = {"op": "error", "detail": str(e)}
+    connection.offer(ControlFrame(reply))
+
+# Endpoint lama /ws/<topic> adalah koneksi dengan satu subscription tetap
+async def connect_client_light(websocket: WebSocket):
+    subscribe(await connect_client(websocket), "light")
 
 async def connect_client_door(websocket: WebSocket):
-    await websocket.accept()
-    connected_clients_door.append(websocket)
+    subscribe(await connect_client(websocket), "door")
 
 async def connect_client_clothesline(websocket: WebSocket):
-    await websocket.accept()
-    connected_clients_clothesline.append(websocket)
+    subscribe(await connect_client(websocket), "clothesline")
 
 async def connect_client_alert(websocket: WebSocket):
-    await websocket.accept()
-    connected_clients_alert.append(websocket)
+    subscribe(await connect_client(websocket), "alert")
 
 
 def disconnect_client_light(websocket: WebSocket):
-    if websocket in connected_clients_light:
-        connected_clients_light.remove(websocket)
+    disconnect_client(websocket)
 
 def disconnect_client_door(websocket: WebSocket):
-    if websocket in connected_clients_door:
-        connected_clients_door.remove(websocket)
+    disconnect_client(websocket)
 
 def disconnect_client_clothesline(websocket: WebSocket):
-    if websocket in connected_clients_clothesline:
-        connected_clients_clothesline.remove(websocket)
+    disconnect_client(websocket)
 
 def disconnect_client_alert(websocket: WebSocket):
-    if websocket in connected_clients_alert:
-        connected_clients_alert.remove(websocket)
+    disconnect_client(websocket)
 
 # === Fungsi broadcast ke WebSocket ===
-
-async def broadcast_light_status(data: dict):
-    disconnected = []
-    for client in connected_clients_light:
-        try:
-            await client.send_json(data)
-            logger.info(f"Broadcast to {client.client}: {data}")
-        except:
-            disconnected.append(client)
-    for client in disconnected:
-        disconnect_client_light(client)
-
-async def broadcast_door_status(data: dict):
-    disconnected = []
-    for client in connected_clients_door:
-        try:
-            await client.send_json(data)
-            logger.info(f"Broadcast to {client.client}: {data}")
-        except:
-            disconnected.append(client)
-    for client in disconnected:
-        disconnect_client_door(client)
-
-async def broadcast_clothesline_status(data: dict):
-    disconnected = []
-    for client in connected_clients_clothesline:
-        try:
-            await client.send_json(data)
-        except:
-            disconnected.append(client)
-    for client in disconnected:
-        disconnect_client_clothesline(client)
-
-async def broadcast_alert_status(data: dict):
-    disconnected = []
-    for client in connected_clients_alert:
-        try:
-            await client.send_json(data)
-            logger.info(f"Broadcast to {client.client}: {data}")
-        except:
-            disconnected.append(client)
-    for client in disconnected:
-        disconnect_client_alert(client)
+# Broadcast hanya memasukkan pesan ke antrean tiap koneksi, tidak menunggu send.
+# Payload di-encode sekali per bentuk frame, bukan sekali per client.
+
+async def broadcast(topic: str, data: dict):
+    started = time.perf_counter()
+    subscribers = [c for c in _subscribers[topic] if c.matches(topic, data)]
+    if not subscribers:
+        return
+    frame = BroadcastFrame(topic, data)
+    for connection in subscribers:
+        connection.offer(frame)
+    WS_BROADCAST_SECONDS.labels(topic).observe(time.perf_counter() - started)
+    logger.debug(f"Broadcast {topic} to {len(subscribers)} clients")